@@ -1,107 +1,151 @@
 from bs4 import BeautifulSoup, NavigableString
+from bisect import bisect_left, bisect_right
 import json
-import re
 import uuid
 import os
+import io
 
-def clean_text(text):
-    # Remove extra whitespace and newlines
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
-
-def simple_sentence_tokenize(text):
-    """Simple sentence tokenizer using common sentence endings"""
-    sentences = re.split(r'(?<=[.!?])\s+(?=[A-Z])', text)
-    return [s.strip() for s in sentences if s.strip()]
-
-def find_most_referenced_visual(text, all_visuals):
-    """Find the visual element that is most referenced in the text, with priority to first mention"""
-    figure_counts = {}
-    table_counts = {}
-    first_figure = None
-    first_table = None
-    
-    # Find all visual references
-    figure_matches = list(re.finditer(r'Figure\s+(\d+)', text))
-    table_matches = list(re.finditer(r'Table\s+(\d+)', text))
-    
-    # Track first mentions
-    if figure_matches:
-        first_fig_num = figure_matches[0].group(1)
-        first_figure = f"fig{first_fig_num}"
+from textProcessing import (clean_text, simple_sentence_tokenize, tokenize_paragraph,
+                            find_visual_references, most_referenced_visual, link_segments, reference_index,
+                            TABLE_NUMBER_PATTERN, TABLE_ID_NUMBER_PATTERN)
+from precompressed import write_precompressed
+from contentSections import write_section_files
+from imageVariants import add_image_variants
+from searchIndex import write_search_index
+from articleDatabase import STORAGE_BACKEND, write_article_database
+
+# Tree builder for html_to_json. html.parser is the default because the others close unclosed
+# <li>/<td> tags the way browsers do, where html.parser nests what follows inside them, so the
+# same page can give different JSON. 'lxml' is faster, 'auto' uses it when it is installed, and
+# 'html5lib' can also be chosen.
+HTML_PARSER = os.environ.get('HTML_PARSER', 'html.parser')
+PARSER_BACKENDS = ['lxml', 'html.parser', 'html5lib']
+
+def is_linkable_visual(element):
+    """Check if element is a figure/table whose ID can be associated with text"""
+    if element.name not in ['figure', 'table']:
+        return False
+    visual_id = element.get('id')
+    # Skip if the ID contains an underscore
+    return bool(visual_id) and '_' not in visual_id
+
+def has_class(tag, class_name):
+    return class_name in (tag.get('class') or [])
+
+def scan_document(soup):
+    """Collect everything html_to_json looks up in one forward pass over the document"""
+    scan = {
+        'front_matter': None,
+        'abstract': None,
+        'body': None,
+        'bibliography': None,
+        'visuals': [],                  # figures and tables in document order
+        'positions': {},                # id(tag) -> index in document order
+        'figures': [],
+        'figure_positions': [],
+        'caption_positions': [],        # div.table-caption elements and where they are
+        'captions': [],
+        'previous_visual_sibling': {}   # id(tag) -> closest earlier figure/table sibling
+    }
+    last_visual_child = {}
+
+    for position, tag in enumerate(soup.find_all(True)):
+        scan['positions'][id(tag)] = position
         
-    if table_matches:
-        first_table_num = table_matches[0].group(1)
-        first_table = f"table{first_table_num}"
-    
-    # Count all mentions
-    for match in figure_matches:
-        fig_num = match.group(1)
-        fig_id = f"fig{fig_num}"
-        figure_counts[fig_id] = figure_counts.get(fig_id, 0) + 1
+        # Children are reached in order, so the parent's last visual child so far
+        # is this tag's closest preceding visual sibling
+        parent_id = id(tag.parent)
+        scan['previous_visual_sibling'][id(tag)] = last_visual_child.get(parent_id)
         
-    for match in table_matches:
-        table_num = match.group(1)
-        table_id = f"table{table_num}"
-        table_counts[table_id] = table_counts.get(table_id, 0) + 1
-    
-    # Validate references exist in all_visuals
-    valid_visuals = {v['id'] for v in all_visuals}
-    figure_counts = {k: v for k, v in figure_counts.items() if k in valid_visuals}
-    table_counts = {k: v for k, v in table_counts.items() if k in valid_visuals}
-    
-    # Combine and find most referenced
-    all_refs = {**figure_counts, **table_counts}
-    
-    if not all_refs:
-        return None
+        if tag.name in ['figure', 'table']:
+            scan['visuals'].append(tag)
+            last_visual_child[parent_id] = tag
+            if tag.name == 'figure':
+                scan['figures'].append(tag)
+                scan['figure_positions'].append(position)
+        elif tag.name == 'div':
+            if has_class(tag, 'table-caption'):
+                scan['caption_positions'].append(position)
+                scan['captions'].append(tag)
+            elif scan['abstract'] is None and has_class(tag, 'abstract'):
+                scan['abstract'] = tag
+        elif tag.name == 'section':
+            if scan['front_matter'] is None and has_class(tag, 'front-matter'):
+                scan['front_matter'] = tag
+            elif scan['body'] is None and has_class(tag, 'body'):
+                scan['body'] = tag
+        elif tag.name == 'ul' and scan['bibliography'] is None and has_class(tag, 'bibUl'):
+            scan['bibliography'] = tag
+    
+    return scan
+
+def previous_table_caption(scan, element):
+    """Same as element.find_previous('div', class_='table-caption'), without walking the document"""
+    index = bisect_left(scan['caption_positions'], scan['positions'][id(element)])
+    return scan['captions'][index - 1] if index > 0 else None
+
+def next_table_caption(scan, element):
+    """Same as element.find_next('div', class_='table-caption'), without walking the document"""
+    index = bisect_right(scan['caption_positions'], scan['positions'][id(element)])
+    return scan['captions'][index] if index < len(scan['captions']) else None
+
+class VisualIndex:
+    """Lookups over a document's visuals, built once so each paragraph doesn't rescan them"""
+
+    def __init__(self, all_visuals, scan):
+        # IDs of every visual, for validating "Figure N"/"Table N" references
+        self.ids = {v['id'] for v in all_visuals}
         
-    # Prioritize first mention if it has more than one mention
-    if first_figure and figure_counts.get(first_figure, 0) > 0:
-        return first_figure
-    if first_table and table_counts.get(first_table, 0) > 0:
-        return first_table
+        # Sourcelines of visuals with usable IDs, in order, for bisecting
+        linkable = [v for v in all_visuals if '_' not in v['id']]
+        self.sourcelines = [v['sourceline'] for v in linkable]
+        self.linkable_ids = [v['id'] for v in linkable]
         
-    return max(all_refs.items(), key=lambda x: x[1])[0]
+        # Closest earlier figure/table sibling of every element, from the document scan
+        self.previous_visual_sibling = scan['previous_visual_sibling']
+
+    def previous_sibling(self, element):
+        # Tables only get their IDs after the scan, so check IDs here and step
+        # back past siblings that can't be linked
+        sibling = self.previous_visual_sibling.get(id(element))
+        while sibling is not None:
+            if is_linkable_visual(sibling):
+                return sibling.get('id')
+            sibling = self.previous_visual_sibling.get(id(sibling))
+        return None
+
+    def last_before(self, sourceline):
+        """Return the last usable visual that appears before sourceline"""
+        index = bisect_left(self.sourcelines, sourceline)
+        return self.linkable_ids[index - 1] if index > 0 else None
 
-def find_nearest_visual(element, all_visuals, text=None):
+def find_nearest_visual(element, visual_index, text=None, references=None):
     """Find the most appropriate visual based on content or proximity"""
-    # If text is provided, try to find the most referenced visual
-    if text:
-        most_referenced = find_most_referenced_visual(text, all_visuals)
+    # If text (or the references tokenize_paragraph already found in it) is provided,
+    # try to find the most referenced visual
+    if references is None and text:
+        references = find_visual_references(text)
+    if references:
+        most_referenced = most_referenced_visual(references, visual_index.ids)
         if most_referenced:
             return most_referenced
     
     # Fallback to proximity-based approach
-    current = element.previous_sibling
-    while current:
-        if isinstance(current, NavigableString):
-            current = current.previous_sibling
-            continue
-        if current.name in ['figure', 'table']:
-            visual_id = current.get('id')
-            # Skip if the ID contains an underscore
-            if visual_id and '_' not in visual_id:
-                return visual_id
-        current = current.previous_sibling
+    visual_id = visual_index.previous_sibling(element)
+    if visual_id:
+        return visual_id
     
     # If no previous visual found in siblings, find the most recent visual that appears before this element
-    element_position = element.sourceline
-    # Filter out visuals with underscore in their ID
-    previous_visuals = [v for v in all_visuals 
-                       if v['sourceline'] < element_position 
-                       and '_' not in v['id']]
-    if previous_visuals:
-        return previous_visuals[-1]['id']
-    return None
-
-def process_abstract(abstract_div):
+    return visual_index.last_before(element.sourceline)
+
+def process_abstract(abstract_div, scan):
     """Process abstract div and split into sentences"""
     abstract_text = clean_text(abstract_div.get_text())
     sentences = simple_sentence_tokenize(abstract_text)
     
-    # Find the first figure in the document
-    first_figure = abstract_div.find_next('figure')
+    # Find the first figure after the abstract in the document
+    index = bisect_right(scan['figure_positions'], scan['positions'][id(abstract_div)])
+    first_figure = scan['figures'][index] if index < len(scan['figures']) else None
     first_figure_id = first_figure.get('id') if first_figure else None
     
     return {
@@ -114,7 +158,7 @@ def process_abstract(abstract_div):
         } for i, sent in enumerate(sentences, 1)]
     }
 
-def extract_visual_element(element, element_type):
+def extract_visual_element(element, element_type, scan):
     """Extract data for figure or table"""
     element_id = element.get('id', '')
     
@@ -154,10 +198,10 @@ def extract_visual_element(element, element_type):
     else:
         # Table processing with improved caption handling
         if not element_id:
-            caption_div = element.find_previous('div', class_='table-caption')
+            caption_div = previous_table_caption(scan, element)
             if caption_div:
                 caption_text = caption_div.get_text()
-                table_num_match = re.search(r'Table\s+(\d+)', caption_text)
+                table_num_match = TABLE_NUMBER_PATTERN.search(caption_text)
                 if table_num_match:
                     element_id = f"table{table_num_match.group(1)}"
                 else:
@@ -179,14 +223,14 @@ def extract_visual_element(element, element_type):
             }
         }
         
-        caption_div = element.find_previous('div', class_='table-caption')
+        caption_div = previous_table_caption(scan, element)
         if not caption_div:
-            caption_div = element.find_next('div', class_='table-caption')
+            caption_div = next_table_caption(scan, element)
             
         if caption_div:
             caption_text = clean_text(caption_div.get_text())
-            table_num_match = re.search(r'Table\s+(\d+)', caption_text)
-            current_table_num = re.search(r'table(\d+)', element_id)
+            table_num_match = TABLE_NUMBER_PATTERN.search(caption_text)
+            current_table_num = TABLE_ID_NUMBER_PATTERN.search(element_id)
             
             if (table_num_match and current_table_num and 
                 table_num_match.group(1) == current_table_num.group(1)):
@@ -250,7 +294,7 @@ def get_section_number_and_title(section):
     
     return "", ""
 
-def process_list(list_element, all_visuals):
+def process_list(list_element, visual_index):
     """Process an ordered or unordered list"""
     items = []
     list_type = list_element.name  # 'ol' or 'ul'
@@ -271,7 +315,7 @@ def process_list(list_element, all_visuals):
                 'id': f"{list_id}_s1",
                 'text': item_text,
                 'context': 'List Item',
-                'associated_visual': find_nearest_visual(li, all_visuals, item_text)
+                'associated_visual': find_nearest_visual(li, visual_index, item_text)
             }]
         }
         
@@ -279,7 +323,14 @@ def process_list(list_element, all_visuals):
     
     return items
 
-def process_emphasized_paragraph(p, section_id, context, all_visuals):
+def add_link_segments(sentences, citations, visual_ids):
+    """Resolve each sentence's citations and figure mentions, so the reader doesn't have to"""
+    for sentence in sentences:
+        segments = link_segments(sentence['text'], citations, visual_ids)
+        if segments:
+            sentence['segments'] = segments
+
+def process_emphasized_paragraph(p, section_id, context, visual_index, citations=None):
     """Process a paragraph that starts with emphasized text, extracting both title and content"""
     full_text = clean_text(p.get_text())
     em = p.find('em')
@@ -293,10 +344,10 @@ def process_emphasized_paragraph(p, section_id, context, all_visuals):
     if not remaining_text:
         return None
         
-    associated_visual = find_nearest_visual(p, all_visuals, remaining_text)
-    sentences = simple_sentence_tokenize(remaining_text)
+    sentences, references = tokenize_paragraph(remaining_text)
+    associated_visual = find_nearest_visual(p, visual_index, references=references)
     
-    return {
+    paragraph = {
         'full_text': remaining_text,
         'sentences': [{
             'id': f"{section_id}_p1_s{i}",
@@ -305,8 +356,11 @@ def process_emphasized_paragraph(p, section_id, context, all_visuals):
             'associated_visual': associated_visual
         } for i, sent in enumerate(sentences, 1)]
     }
+    if citations is not None:
+        add_link_segments(paragraph['sentences'], citations, visual_index.ids)
+    return paragraph
 
-def process_section(section, all_visuals, parent_number=""):
+def process_section(section, visual_index, parent_number="", citations=None):
     """Process a section and its contents, including nested sections"""
     section_id = section.get('id', f"section_{str(uuid.uuid4())[:8]}")
     section_number, section_title = get_section_number_and_title(section)
@@ -341,7 +395,7 @@ def process_section(section, all_visuals, parent_number=""):
             
         if child.name == 'section':
             # Process nested section
-            subsection_data = process_section(child, all_visuals, full_section_number)
+            subsection_data = process_section(child, visual_index, full_section_number, citations)
             if subsection_data['paragraphs'] or subsection_data['subsections'] or subsection_data['lists']:
                 section_data['subsections'].append(subsection_data)
                 
@@ -352,14 +406,14 @@ def process_section(section, all_visuals, parent_number=""):
             # Check if this is a paragraph with emphasized section title
             if child.find('em') and child.find('span', class_='section-number'):
                 # Process the rest of the paragraph content if it exists
-                paragraph_data = process_emphasized_paragraph(child, section_id, context, all_visuals)
+                paragraph_data = process_emphasized_paragraph(child, section_id, context, visual_index, citations)
                 if paragraph_data:
                     section_data['paragraphs'].append(paragraph_data)
             else:
                 # Process regular paragraph
                 text = clean_text(child.get_text())
-                associated_visual = find_nearest_visual(child, all_visuals, text)
-                sentences = simple_sentence_tokenize(text)
+                sentences, references = tokenize_paragraph(text)
+                associated_visual = find_nearest_visual(child, visual_index, references=references)
                 
                 paragraph_data = {
                     'full_text': text,
@@ -370,10 +424,12 @@ def process_section(section, all_visuals, parent_number=""):
                         'associated_visual': associated_visual
                     } for i, sent in enumerate(sentences, 1)]
                 }
+                if citations is not None:
+                    add_link_segments(paragraph_data['sentences'], citations, visual_index.ids)
                 section_data['paragraphs'].append(paragraph_data)
             
         elif child.name == 'ul' or child.name == 'ol':
-            list_items = process_list(child, all_visuals)
+            list_items = process_list(child, visual_index)
             if list_items:
                 section_data['lists'].extend(list_items)
                 
@@ -382,9 +438,8 @@ def process_section(section, all_visuals, parent_number=""):
     
     return section_data
 
-def extract_front_matter(soup):
-    """Extract front matter information from the HTML"""
-    front_matter = soup.find('section', class_='front-matter')
+def extract_front_matter(front_matter):
+    """Extract front matter information from the front-matter section"""
     if not front_matter:
         return None
         
@@ -478,10 +533,9 @@ def extract_front_matter(soup):
     
     return data
 
-def extract_references(soup):
-    """Extract references from bibliography section and save to JSON"""
+def extract_references(bib_ul, output_dir='static'):
+    """Extract references from bibliography list and save to JSON"""
     references = []
-    bib_ul = soup.find('ul', class_='bibUl')
     
     if not bib_ul:
         return None
@@ -505,27 +559,69 @@ def extract_references(soup):
         references.append(reference)
     
     # Save to JSON file
-    output_path = os.path.join('static', 'references.json')
+    output_path = os.path.join(output_dir, 'references.json')
     with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(references, f, indent=4)
         
     print(f"Successfully saved references to {output_path}")
     return references
 
-def html_to_json(html_file):
+def choose_parser(backend='auto'):
+    """Resolve 'auto' to the fastest installed tree builder"""
+    if backend != 'auto':
+        if backend not in PARSER_BACKENDS:
+            raise ValueError(f"Unknown HTML parser {backend!r}, expected one of {', '.join(PARSER_BACKENDS)}")
+        return backend
+    try:
+        import lxml
+        return 'lxml'
+    except ImportError:
+        return 'html.parser'
+
+def add_lxml_sourcelines(soup, markup):
+    """Give every tag a sourceline, which bs4's lxml builder doesn't record; False if that can't be done"""
+    from lxml import etree
+    
+    # lxml's own parser sees the same elements in the same order, and it does know
+    # their line numbers, so copy those across
+    events = etree.iterparse(io.BytesIO(markup.encode('utf-8')), events=('start',), html=True,
+                             encoding='utf-8')
+    lines = [element.sourceline for _, element in events]
+    tags = soup.find_all(True)
+    if len(lines) != len(tags):
+        # The two parses disagree about the elements, so the lines can't be matched up
+        return False
+    for tag, line in zip(tags, lines):
+        tag.sourceline = line
+    return True
+
+def parse_html(markup, backend='auto'):
+    """Build the soup with the chosen tree builder, with sourcelines on every backend"""
+    backend = choose_parser(backend)
+    soup = BeautifulSoup(markup, backend)
+    if backend == 'lxml' and not add_lxml_sourcelines(soup, markup):
+        # Visuals are ordered and matched to paragraphs by line, so don't guess them
+        print("Warning: lxml line numbers unavailable, parsing with html.parser instead")
+        soup = BeautifulSoup(markup, 'html.parser')
+    return soup
+
+def html_to_json(html_file, output_dir='static', parser=HTML_PARSER):
     with open(html_file, 'r', encoding='utf-8') as f:
-        soup = BeautifulSoup(f.read(), 'html.parser')
+        soup = parse_html(f.read(), parser)
+    
+    # Find the front matter, abstract, body, visuals and references in one pass
+    scan = scan_document(soup)
     
     # Extract references
-    references = extract_references(soup)
+    references = extract_references(scan['bibliography'], output_dir)
     if references:
         print(f"Extracted {len(references)} references")
     
     # Extract front matter first
-    front_matter_data = extract_front_matter(soup)
+    front_matter_data = extract_front_matter(scan['front_matter'])
     if front_matter_data:
         # Save front matter to title.json
-        output_path = os.path.join('static', 'title.json')
+        output_path = os.path.join(output_dir, 'title.json')
         with open(output_path, 'w', encoding='utf-8') as f:
             json.dump(front_matter_data, f, indent=4)
         print(f"Successfully saved front matter to {output_path}")
@@ -540,35 +636,61 @@ def html_to_json(html_file):
     }
     
     # Process abstract
-    abstract_div = soup.find('div', class_='abstract')
+    abstract_div = scan['abstract']
     if abstract_div:
-        content['abstract'] = process_abstract(abstract_div)
+        content['abstract'] = process_abstract(abstract_div, scan)
 
-    # Find and process body section
-    body_section = soup.find('section', class_='body')
+    # Process body section
+    body_section = scan['body']
     if body_section:
-        # Process figures and tables first, searching recursively
+        # Process figures and tables first, from anywhere in the document
         all_visuals = []
-        for elem in soup.find_all(['figure', 'table']):  # Search entire document recursively
+        for elem in scan['visuals']:
             element_type = elem.name
-            visual_data = extract_visual_element(elem, element_type)
+            visual_data = extract_visual_element(elem, element_type, scan)
             content['body']['visual_elements'].append(visual_data)
             all_visuals.append(visual_data)
 
+        # Thumbnail, reading-width and full-size copies of each figure, when Pillow is installed
+        for visual_data in all_visuals:
+            add_image_variants(visual_data, os.path.join(output_dir, 'images'))
+
         # Sort visuals by source line to maintain sequence
         all_visuals.sort(key=lambda x: x['sourceline'])
+        visual_index = VisualIndex(all_visuals, scan)
+        # Bibliography labels ("[12]") to reference ids, for linking citations in the text
+        citations = reference_index(references or [])
 
         # Process all top-level sections
         for section in body_section.find_all('section', recursive=False):
-            section_data = process_section(section, all_visuals)
+            section_data = process_section(section, visual_index, citations=citations)
             content['body']['sections'].append(section_data)
 
     # Save to JSON file
-    output_path = os.path.join('static', 'content.json')
+    output_path = os.path.join(output_dir, 'content.json')
     with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(content, f, indent=4)
 
     print(f"Successfully converted HTML to JSON. Saved to {output_path}")
+
+    # The same content split up so the reader can load one section at a time
+    section_paths = write_section_files(content, output_dir)
+    print(f"Saved outline and {len(section_paths) - 1} sections to {output_dir}")
+
+    # Every sentence indexed for /search
+    print(f"Saved search index to {write_search_index(content, output_dir)}")
+
+    # The same data in indexed tables, for serving one section, figure or reference at a time
+    if STORAGE_BACKEND == 'sqlite':
+        database = write_article_database(content, front_matter_data, references, output_dir)
+        print(f"Saved article database to {database}")
+
+    # Compressed copies and ETags for the server to send as they are
+    output_paths = [os.path.join(output_dir, name)
+                    for name in ['content.json', 'title.json', 'references.json']]
+    for path in output_paths + section_paths:
+        if os.path.exists(path):
+            write_precompressed(path)
     return content
 
 if __name__ == "__main__":
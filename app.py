@@ -1,10 +1,94 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import (Flask, render_template, request, url_for, jsonify, send_from_directory,
+                   abort, make_response)
+import atexit
 import os
-import subprocess
 import json
+import time
+from pipeline import convert_article
+from jobs import JobQueue, QueueFullError
+from articleStore import ARTICLES_DIR, article_dir, article_paths, is_valid_key, publish_listeners
+from conversionCache import ConversionCache
+from driverPool import DriverPool
+from exportToHTML import fetch_lazy_image
+from precompressed import (choose_variant, output_versions, content_hash, compressed_variants, ENCODINGS,
+                           MANIFEST_FILE)
+from responseCache import ResponseCache
+from contentSections import SECTIONS_DIR, section_filename
+from searchIndex import SEARCH_INDEX_FILE, SearchIndex, CorpusIndex, search
+from articleDatabase import (STORAGE_BACKEND, database_path, has_database, read_section, read_visual,
+                             read_reference)
+import threading
 
 app = Flask(__name__)
 
+# Conversion workers; each job writes to its own article directory
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+# How many submitted URLs may wait for a worker before /process refuses more
+app.config['JOB_QUEUE_LIMIT'] = int(os.environ.get('JOB_QUEUE_LIMIT', 20))
+# Stored conversions are redone after CACHE_MAX_AGE seconds, checked against the
+# source after CACHE_REVALIDATE_AFTER seconds, and evicted past CACHE_MAX_BYTES
+app.config['CACHE_MAX_AGE'] = int(os.environ.get('CACHE_MAX_AGE', 30 * 24 * 3600))
+app.config['CACHE_REVALIDATE_AFTER'] = int(os.environ.get('CACHE_REVALIDATE_AFTER', 24 * 3600))
+app.config['CACHE_MAX_BYTES'] = int(os.environ.get('CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+cache = ConversionCache(ARTICLES_DIR,
+                        max_age=app.config['CACHE_MAX_AGE'],
+                        max_bytes=app.config['CACHE_MAX_BYTES'],
+                        revalidate_after=app.config['CACHE_REVALIDATE_AFTER'])
+# Cache hits write their last_used times in batches; write out the last batch on exit
+atexit.register(cache.flush)
+
+# Headless browsers kept running between conversions; one per worker by default,
+# each restarted after DRIVER_MAX_PAGES pages
+app.config['DRIVER_POOL_SIZE'] = int(os.environ.get('DRIVER_POOL_SIZE', app.config['JOB_WORKERS']))
+app.config['DRIVER_MAX_PAGES'] = int(os.environ.get('DRIVER_MAX_PAGES', 50))
+
+drivers = DriverPool(size=app.config['DRIVER_POOL_SIZE'], max_pages=app.config['DRIVER_MAX_PAGES'])
+atexit.register(drivers.close)
+
+def warm_drivers():
+    try:
+        drivers.warm()
+    except Exception as e:
+        print(f"Failed to start browsers ahead of time: {e}")
+
+warm_started = False
+warm_lock = threading.Lock()
+
+def start_warming():
+    # Start the browsers in the background so the server comes up right away
+    global warm_started
+    with warm_lock:
+        if warm_started:
+            return
+        warm_started = True
+    threading.Thread(target=warm_drivers, daemon=True).start()
+
+# With debug=True, the reloader's parent process only watches files and its child serves
+# requests (with WERKZEUG_RUN_MAIN set), so only the child starts browsers. Anywhere else
+# they start with the first request.
+if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    start_warming()
+
+@app.before_request
+def warm_on_first_request():
+    if not warm_started:
+        start_warming()
+
+# Which resources a conversion downloads: figures (default), lazy or archival;
+# see exportToHTML.FETCH_POLICIES
+app.config['FETCH_POLICY'] = os.environ.get('FETCH_POLICY', 'figures')
+
+def run_conversion(url, progress=None):
+    """Job body: convert the article and return where the result can be viewed"""
+    key = convert_article(url, progress=progress, cache=cache, drivers=drivers,
+                          fetch_policy=app.config['FETCH_POLICY'])
+    return f'/articles/{key}'
+
+jobs = JobQueue(run_conversion,
+                workers=app.config['JOB_WORKERS'],
+                max_pending=app.config['JOB_QUEUE_LIMIT'])
+
 @app.route('/', methods=['GET'])
 def index():
     return render_template('intro.html')
@@ -13,29 +97,296 @@ def index():
 def process():
     url = request.form['url']  # Get URL from the form
     
+    # Articles that are already converted don't need a job at all; answer with the stored copy
+    # right away, and when it is due for a check against its source, do that in a job
+    key = cache.lookup(url, revalidate_stale=False)
+    if key:
+        if cache.claim_revalidation(url):
+            try:
+                jobs.submit(url)
+            except QueueFullError:
+                cache.release_revalidation(url)
+        return jsonify({'status': 'done', 'result': f'/articles/{key}'}), 200
+
     try:
-        # Run exportToHTML.py with the URL
-        subprocess.run(['python3', 'exportToHTML.py', url], check=True)
-        
-        # Run HTMLToJSON.py
-        subprocess.run(['python3', 'HTMLToJSON.py'], check=True)
-        
-        # After processing, redirect to the result page
-        return redirect(url_for('show_result'))
-    except subprocess.CalledProcessError as e:
-        return jsonify({'error': f'Processing failed: {str(e)}'}), 500
+        # Queue the conversion and answer right away; the client polls /jobs/<id>
+        job = jobs.submit(url)
+    except QueueFullError as e:
+        response = jsonify({'error': f'Server is busy: {str(e)}'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+
+    status_url = url_for('job_status', job_id=job['id'])
+    response = jsonify({'job_id': job['id'], 'status_url': status_url})
+    response.headers['Location'] = status_url
+    return response, 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify(job), 200
+
+# Encoded JSON responses are kept in memory, up to RESPONSE_CACHE_MAX_BYTES, until the file
+# behind them changes or the pipeline publishes a new copy of the article
+app.config['RESPONSE_CACHE_MAX_BYTES'] = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 ** 2))
+responses = ResponseCache(max_bytes=app.config['RESPONSE_CACHE_MAX_BYTES'])
+publish_listeners.append(responses.invalidate)
+
+# The JSON files the reader downloads; see send_output_file
+DATA_FILES = ['content', 'outline', 'title', 'references']
 
 @app.route('/result')
 def show_result():
-    return render_template('test.html')
+    return render_template('test.html', article_key=None, data_versions=output_versions('static', DATA_FILES))
+
+def stored_article_dir(key):
+    # Keys are hex digests, so anything else can't name a stored article
+    if not is_valid_key(key):
+        abort(404)
+    return article_dir(key, ARTICLES_DIR)
+
+@app.route('/articles/<key>')
+def show_article(key):
+    if not os.path.isdir(stored_article_dir(key)):
+        abort(404)
+    return render_template('test.html', article_key=key,
+                           data_versions=output_versions(stored_article_dir(key), DATA_FILES))
+
+def send_output_file(directory, filename):
+    """Send a JSON file the pipeline wrote, precompressed if the client accepts it"""
+    path = os.path.join(directory, filename)
+    if not os.path.isfile(path):
+        abort(404)
+    accepted = frozenset(encoding for encoding in ('br', 'gzip') if request.accept_encodings[encoding])
+
+    def build():
+        send_path, encoding, etag = choose_variant(path, accepted)
+        with open(send_path, 'rb') as f:
+            body = f.read()
+        return (body, encoding, etag), len(body)
+
+    body, encoding, etag = responses.get((os.path.abspath(directory), filename, accepted),
+                                         [path, os.path.join(directory, MANIFEST_FILE)], build)
+    return send_body(body, encoding, etag)
+
+def send_body(body, encoding, etag):
+    # ?v=<hash> URLs never change content, so they can be cached for good; anything else
+    # is revalidated, which costs a 304 when nothing changed
+    if request.args.get('v') and request.args.get('v') == etag.split('-')[0]:
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'no-cache'
+
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = app.response_class(body, mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+# files (default), or sqlite: sections, figures and references are read with indexed lookups from
+# the article.sqlite3 conversions write with STORAGE_BACKEND=sqlite, for articles that have one
+app.config['STORAGE_BACKEND'] = STORAGE_BACKEND
+
+def use_database(directory):
+    return app.config['STORAGE_BACKEND'] == 'sqlite' and has_database(directory)
+
+def send_document(directory, name, paths, read):
+    """Send the JSON document read() returns as (text, ETag, compressed copies), or 404 for None
+
+    Cached with the responses until one of paths changes, and sent like send_output_file's files.
+    """
+    accepted = frozenset(encoding for encoding in ('br', 'gzip') if request.accept_encodings[encoding])
+
+    def build():
+        document = read()
+        if document is None:
+            return None, 0
+        text, etag, variants = document
+        for encoding, _ in ENCODINGS:
+            if encoding in accepted and encoding in variants:
+                return (variants[encoding], encoding, f"{etag}-{encoding}"), len(variants[encoding])
+        body = text.encode('utf-8')
+        return (body, None, etag), len(body)
+
+    sent = responses.get((os.path.abspath(directory), name, accepted), paths, build)
+    if sent is None:
+        abort(404)
+    return send_body(*sent)
+
+def json_document(data):
+    # What the article database stores for a row, for answering without one
+    if data is None:
+        return None
+    text = json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+    body = text.encode('utf-8')
+    return text, content_hash(body), compressed_variants(body)
+
+def read_json_file(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        abort(404)
+
+@app.route('/articles/<key>/<any(content, outline, title, references):name>')
+def article_json(key, name):
+    return send_output_file(stored_article_dir(key), f'{name}.json')
+
+# One top-level section of the article at a time, in the order of outline.json
+@app.route('/articles/<key>/sections/<int:index>')
+def article_section(key, index):
+    directory = stored_article_dir(key)
+    if use_database(directory):
+        return send_document(directory, ('section', index), [database_path(directory)],
+                             lambda: read_section(directory, index))
+    return send_output_file(os.path.join(directory, SECTIONS_DIR), section_filename(index))
+
+# One figure or table, as in content.json's visual_elements
+@app.route('/articles/<key>/visuals/<visual_id>')
+def article_visual(key, visual_id):
+    directory = stored_article_dir(key)
+    if use_database(directory):
+        return send_document(directory, ('visual', visual_id), [database_path(directory)],
+                             lambda: read_visual(directory, visual_id))
+
+    def read():
+        # Without a database the whole of content.json has to be read
+        visuals = [visual for visual in read_json_file(article_paths(directory)['content'])['body']['visual_elements']
+                   if visual and visual['id'] == visual_id]
+        return json_document(visuals[-1] if visuals else None)
+    return send_document(directory, ('visual', visual_id), [article_paths(directory)['content']], read)
+
+# One entry of references.json, by its id
+@app.route('/articles/<key>/references/<reference_id>')
+def article_reference(key, reference_id):
+    directory = stored_article_dir(key)
+    if use_database(directory):
+        return send_document(directory, ('reference', reference_id), [database_path(directory)],
+                             lambda: read_reference(directory, reference_id))
+
+    def read():
+        references = [reference for reference in read_json_file(article_paths(directory)['references'])
+                      if reference['id'] == reference_id]
+        return json_document(references[-1] if references else None)
+    return send_document(directory, ('reference', reference_id), [article_paths(directory)['references']], read)
+
+# Takes precedence over Flask's own static route for the sample article's data files
+@app.route('/static/<any(content, outline, title, references):name>.json')
+def static_json(name):
+    return send_output_file('static', f'{name}.json')
+
+@app.route('/static/sections/section_<int:index>.json')
+def static_section(index):
+    return send_output_file(os.path.join('static', SECTIONS_DIR), section_filename(index))
+
+# Most hits one /search request can ask for with ?limit=
+app.config['SEARCH_MAX_RESULTS'] = int(os.environ.get('SEARCH_MAX_RESULTS', 100))
+# Stored articles are searched through one corpus index, updated as articles are published and
+# checked against their search_index.json files (e.g. written by batchConvert.py) on every query
+corpus = CorpusIndex(ARTICLES_DIR)
+publish_listeners.append(corpus.add_article)
+
+def load_search_index(directory):
+    """The article's search index, kept in memory with the responses until its file changes"""
+    path = os.path.join(directory, SEARCH_INDEX_FILE)
+    if not os.path.isfile(path):
+        # Converted before search indexes existed
+        return None
+
+    def build():
+        index = SearchIndex.load(path)
+        return index, index.memory_size()
+
+    return responses.get((os.path.abspath(directory), SEARCH_INDEX_FILE), [path], build)
+
+def reader_url(key, location):
+    # Captions of figures that no paragraph shows have nowhere to jump to
+    if 'state' not in location:
+        return None
+    params = {name: location[name] for name in ('state', 'section', 'paragraph') if name in location}
+    if key is None:
+        return url_for('show_result', **params)
+    return url_for('show_article', key=key, **params)
+
+def search_response(run_search):
+    """Answer ?q= with run_search(query, limit)'s ranked sentences and where to read them"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        limit = max(0, min(int(request.args.get('limit', 20)), app.config['SEARCH_MAX_RESULTS']))
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+
+    start = time.perf_counter()
+    total, hits = run_search(query, limit)
+    for hit in hits:
+        hit['url'] = reader_url(hit['article'], hit['location'])
+    return jsonify({
+        'query': query,
+        'total': total,
+        'hits': hits,
+        'took_ms': round((time.perf_counter() - start) * 1000, 2)
+    }), 200
+
+@app.route('/search')
+def search_articles():
+    # Every stored article, or only the ones named by ?article=<key> (may be repeated)
+    keys = request.args.getlist('article') or None
+    for key in keys or []:
+        # 404 for anything that can't be a key
+        stored_article_dir(key)
+
+    def run_search(query, limit):
+        corpus.sync(keys)
+        return corpus.search(query, limit, keys)
+    return search_response(run_search)
+
+@app.route('/articles/<key>/search')
+def search_article(key):
+    # 404 for anything that can't be a key
+    stored_article_dir(key)
+
+    def run_search(query, limit):
+        corpus.sync([key])
+        return corpus.search(query, limit, [key])
+    return search_response(run_search)
+
+# The sample article shown at /result
+@app.route('/result/search')
+def search_sample():
+    def run_search(query, limit):
+        index = load_search_index('static')
+        return search([(None, index)] if index else [], query, limit)
+    return search_response(run_search)
+
+@app.route('/articles/<key>/images/<path:filename>')
+def article_image(key, filename):
+    paths = article_paths(stored_article_dir(key))
+    # Lazily converted articles download each figure the first time it is viewed
+    if not os.path.exists(os.path.join(paths['images'], filename)):
+        fetch_lazy_image(filename, paths['html_dir'], paths['images'])
+    return send_from_directory(os.path.abspath(paths['images']), filename)
 
 # Flask route to serve the organized data
 @app.route('/content')
 def content():
-    try:
+    def build():
         with open('static/content.json', 'r') as f:
-            raw_data = json.load(f)
-        return jsonify(raw_data), 200
+            body = jsonify(json.load(f)).get_data()
+        return body, len(body)
+
+    try:
+        body = responses.get((os.path.abspath('static'), 'content.json', 'jsonify'),
+                             ['static/content.json'], build)
+        return app.response_class(body, mimetype='application/json'), 200
     except FileNotFoundError:
         return jsonify({'error': 'content.json not found'}), 404
     except Exception as e:
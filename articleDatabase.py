@@ -0,0 +1,159 @@
+import json
+import os
+import sqlite3
+import sys
+from urllib.request import pathname2url
+
+from contentSections import flatten_section
+from precompressed import compressed_variants, content_hash
+
+# With STORAGE_BACKEND=sqlite, html_to_json also writes the article into article.sqlite3 next to
+# its JSON files, one row per section, figure/table and reference, so the server can answer for
+# one of them with an indexed lookup instead of loading whole files. It sits in the article's
+# directory, so it is published, replaced and evicted with it.
+#
+# Section indices are the reader's (flattened) ones, as in outline.json; a section's data column
+# holds exactly the bytes of sections/section_<i>.json. Like the JSON files (see precompressed.py),
+# every row is compressed once, when it is written, and carries the content hash used as its ETag.
+
+# files (default) or sqlite
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'files')
+DATABASE_FILE = 'article.sqlite3'
+# 2: compressed copies and ETags on every row; no paragraphs and sentences tables
+SCHEMA_VERSION = 2
+
+# Columns every served row has after its own
+SERVED_COLUMNS = 'data TEXT NOT NULL, etag TEXT NOT NULL, data_gzip BLOB NOT NULL, data_br BLOB'
+
+SCHEMA = f"""
+CREATE TABLE documents (name TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE sections (
+    section_index INTEGER PRIMARY KEY, section_id TEXT, title TEXT,
+    paragraph_offset INTEGER, paragraph_count INTEGER, {SERVED_COLUMNS});
+CREATE TABLE visuals (visual_id TEXT PRIMARY KEY, position INTEGER, type TEXT, {SERVED_COLUMNS});
+CREATE TABLE bibliography (reference_id TEXT PRIMARY KEY, label TEXT, position INTEGER, {SERVED_COLUMNS});
+"""
+
+# Created after the rows are in, which is faster than keeping them up to date row by row
+INDEXES = """
+CREATE INDEX bibliography_by_label ON bibliography (label);
+"""
+
+def database_path(directory):
+    return os.path.join(directory, DATABASE_FILE)
+
+def has_database(directory):
+    """Whether directory has an article.sqlite3 this version of the server can read"""
+    if not os.path.isfile(database_path(directory)):
+        return False
+    version = query_one(directory, "SELECT data FROM documents WHERE name = 'schema_version'", ())
+    return version is not None and json.loads(version[0]) == SCHEMA_VERSION
+
+def encode(data):
+    # The same encoding contentSections uses for the section files
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+def served(data):
+    """data's JSON text followed by its ETag and compressed copies, for the SERVED_COLUMNS"""
+    text = encode(data)
+    body = text.encode('utf-8')
+    variants = compressed_variants(body)
+    return text, content_hash(body), variants['gzip'], variants.get('br')
+
+def section_rows(content):
+    """Rows for the sections table, in reading order"""
+    sections = []
+    offset = 0
+    for section_index, section in enumerate(content['body']['sections']):
+        flattened = flatten_section(section)
+        sections.append((section_index, section['id'], section['title'], offset,
+                         len(flattened['paragraphs'])) + served(flattened))
+        offset += len(flattened['paragraphs'])
+    return sections
+
+def write_article_database(content, title, references, output_dir):
+    """Write everything html_to_json produced into output_dir's article.sqlite3; returns its path"""
+    path = database_path(output_dir)
+    # Build a new file rather than updating rows left by an earlier conversion
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    visuals = [visual for visual in content['body']['visual_elements'] if visual]
+    connection = sqlite3.connect(tmp_path)
+    try:
+        # Nothing reads the file until it is renamed into place, so there is nothing to journal
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        with connection:
+            connection.executescript(SCHEMA)
+            connection.executemany('INSERT INTO documents VALUES (?, ?)', [
+                ('schema_version', encode(SCHEMA_VERSION)),
+                ('title', encode(title)),
+                ('abstract', encode(content.get('abstract')))
+            ])
+            connection.executemany('INSERT INTO sections VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', section_rows(content))
+            # Like the reader's maps, a later figure or reference with the same id wins
+            connection.executemany('INSERT OR REPLACE INTO visuals VALUES (?, ?, ?, ?, ?, ?, ?)', [
+                (visual['id'], position, visual['type']) + served(visual)
+                for position, visual in enumerate(visuals)])
+            connection.executemany('INSERT OR REPLACE INTO bibliography VALUES (?, ?, ?, ?, ?, ?, ?)', [
+                (reference['id'], reference['label'].replace('[', '').replace(']', ''), position) + served(reference)
+                for position, reference in enumerate(references or [])])
+            connection.executescript(INDEXES)
+    except Exception:
+        connection.close()
+        os.remove(tmp_path)
+        raise
+    connection.close()
+    os.replace(tmp_path, path)
+    return path
+
+def connect(directory):
+    # Read-only, so a request can never create or change an article's database
+    return sqlite3.connect(f"file:{pathname2url(os.path.abspath(database_path(directory)))}?mode=ro", uri=True)
+
+def query_one(directory, sql, parameters):
+    connection = connect(directory)
+    try:
+        return connection.execute(sql, parameters).fetchone()
+    finally:
+        connection.close()
+
+def read_served(directory, table, column, value):
+    # (JSON text, ETag, {Content-Encoding: compressed data}), or None
+    row = query_one(directory, f'SELECT data, etag, data_gzip, data_br FROM {table} WHERE {column} = ?', (value,))
+    if row is None:
+        return None
+    text, etag, data_gzip, data_br = row
+    variants = {'gzip': data_gzip}
+    if data_br is not None:
+        variants['br'] = data_br
+    return text, etag, variants
+
+def read_section(directory, index):
+    """The reader's flattened section index as (JSON text, ETag, compressed copies), or None"""
+    return read_served(directory, 'sections', 'section_index', index)
+
+def read_visual(directory, visual_id):
+    """A figure or table as it appears in content.json's visual_elements, like read_section"""
+    return read_served(directory, 'visuals', 'visual_id', visual_id)
+
+def read_reference(directory, reference_id):
+    """A references.json entry, like read_section"""
+    return read_served(directory, 'bibliography', 'reference_id', reference_id)
+
+if __name__ == "__main__":
+    # Add databases to articles converted without them: articleDatabase.py articles/<key> ...
+    for directory in sys.argv[1:] or ['static']:
+        with open(os.path.join(directory, 'content.json'), 'r', encoding='utf-8') as f:
+            content = json.load(f)
+        documents = {}
+        for name in ('title', 'references'):
+            try:
+                with open(os.path.join(directory, f'{name}.json'), 'r', encoding='utf-8') as f:
+                    documents[name] = json.load(f)
+            except FileNotFoundError:
+                documents[name] = None
+        path = write_article_database(content, documents['title'], documents['references'], directory)
+        print(f"Wrote {path} ({os.path.getsize(path)} bytes)")
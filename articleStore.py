@@ -0,0 +1,99 @@
+import glob
+import hashlib
+import os
+import re
+import shutil
+import uuid
+from urllib.parse import urlsplit, urlunsplit, unquote
+
+# Every converted article gets its own directory under here
+ARTICLES_DIR = 'articles'
+
+# DOIs look like 10.<registrant>/<suffix>, e.g. 10.1145/3613904.3642782
+DOI_PATTERN = re.compile(r'(10\.\d{4,9}/[^\s?#]+)')
+KEY_PATTERN = re.compile(r'^[0-9a-f]{16}$')
+
+# Called with the directory of every article publish_article puts in place, so the
+# server can drop anything it still holds from an older copy
+publish_listeners = []
+
+def normalize_article_url(url):
+    """Return a canonical identifier for an article: its DOI if the URL has one, else the normalized URL"""
+    url = url.strip()
+    doi_match = DOI_PATTERN.search(unquote(url))
+    if doi_match:
+        # DOIs are case-insensitive, and dl.acm.org/doi/..., /doi/fullHtml/... and
+        # doi.org/... links to the same paper should all share one key
+        return 'doi:' + doi_match.group(1).rstrip('/').lower()
+
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower() or 'https'
+    host = parts.netloc.lower()
+    if (scheme, host.rsplit(':', 1)[-1]) in (('http', '80'), ('https', '443')):
+        host = host.rsplit(':', 1)[0]
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((scheme, host, path, parts.query, ''))
+
+def article_key(url):
+    """Return the storage key for the article at url"""
+    return hashlib.sha256(normalize_article_url(url).encode('utf-8')).hexdigest()[:16]
+
+def is_valid_key(key):
+    return bool(KEY_PATTERN.match(key))
+
+def article_paths(article_dir):
+    """Return the locations of everything stored for one article"""
+    return {
+        'dir': article_dir,
+        'html_dir': os.path.join(article_dir, 'webpage_files'),
+        'html_file': os.path.join(article_dir, 'webpage_files', 'index.html'),
+        'images': os.path.join(article_dir, 'images'),
+        'content': os.path.join(article_dir, 'content.json'),
+        'title': os.path.join(article_dir, 'title.json'),
+        'references': os.path.join(article_dir, 'references.json')
+    }
+
+def article_dir(key, root=ARTICLES_DIR):
+    return os.path.join(root, key)
+
+def has_article(key, root=ARTICLES_DIR):
+    """Check whether a finished conversion is stored under key"""
+    return os.path.exists(article_paths(article_dir(key, root))['content'])
+
+def stored_article_keys(root=ARTICLES_DIR):
+    """Keys of the finished conversions stored under root"""
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return []
+    # Conversions are only renamed into place once finished, and staging directories are
+    # dot-prefixed, so every directory named by a key is complete
+    return sorted(name for name in names if is_valid_key(name))
+
+def new_staging_dir(key, root=ARTICLES_DIR):
+    """Create a private directory to convert into, so half-written output is never visible"""
+    staging_dir = os.path.join(root, f".{key}.{uuid.uuid4().hex[:8]}.tmp")
+    os.makedirs(staging_dir)
+    return staging_dir
+
+def publish_article(staging_dir, key, root=ARTICLES_DIR):
+    """Move a finished conversion into place under key"""
+    final_dir = article_dir(key, root)
+    try:
+        os.rename(staging_dir, final_dir)
+    except OSError:
+        # Another job published the same article first; keep that copy
+        if not has_article(key, root):
+            raise
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    for listener in publish_listeners:
+        listener(final_dir)
+    return final_dir
+
+def discard_staging_dir(staging_dir):
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+def discard_stale_staging_dirs(key, root=ARTICLES_DIR):
+    """Remove staging directories an interrupted conversion of key left behind"""
+    for staging_dir in glob.glob(os.path.join(root, f".{key}.*.tmp")):
+        discard_staging_dir(staging_dir)
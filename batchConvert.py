@@ -0,0 +1,263 @@
+import argparse
+import html
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse, unquote
+
+from articleStore import (ARTICLES_DIR, article_key, article_paths, has_article, new_staging_dir,
+                          publish_article, discard_staging_dir, discard_stale_staging_dirs)
+from conversionCache import ConversionCache, fetch_validators
+from driverPool import DriverPool
+from exportToHTML import (DEFAULT_FETCH_POLICY, FETCH_POLICIES, IMAGE_EXTENSIONS, RESOURCE_ATTR_PATTERN,
+                          publish_file)
+from pipeline import export_stage, parse_stage
+
+# Converts many articles into articles/<key>/ in one go:
+#   python3 batchConvert.py urls.txt
+# Each line of the list is a URL or the path of a page saved by exportToHTML.py; blank lines
+# and lines starting with # are ignored. Articles that are already stored are skipped, so an
+# interrupted run can simply be started again with the same list.
+
+def read_items(list_file):
+    """Read the URLs and saved HTML files to convert, one per line"""
+    items = []
+    with open(list_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                items.append(line)
+    return items
+
+def is_url(item):
+    return item.startswith(('http://', 'https://'))
+
+def item_key(item):
+    # Saved pages have no URL to go by, so they are stored under their absolute path
+    return article_key(item if is_url(item) else os.path.abspath(item))
+
+def saved_page_resources(html_file):
+    """Local files a saved page links to with src or href, as absolute paths"""
+    page_dir = os.path.dirname(os.path.abspath(html_file))
+    with open(html_file, 'r', encoding='utf-8', errors='replace') as f:
+        html_content = f.read()
+    resources = set()
+    for _, value in RESOURCE_ATTR_PATTERN.findall(html_content):
+        parsed = urlparse(html.unescape(value))
+        # Links to other sites, data: URLs and in-page anchors aren't files next to the page
+        if parsed.scheme or parsed.netloc or not parsed.path:
+            continue
+        path = os.path.normpath(os.path.join(page_dir, unquote(parsed.path)))
+        if os.path.isfile(path):
+            resources.add(path)
+    return resources
+
+def copy_saved_page(html_file, staging_dir):
+    """Copy a saved page and the files it links to into staging_dir; returns the copied HTML file"""
+    paths = article_paths(staging_dir)
+    page_dir = os.path.dirname(os.path.abspath(html_file))
+    os.makedirs(paths['html_dir'], exist_ok=True)
+    shutil.copyfile(html_file, paths['html_file'])
+    # The reader asks for figures by file name from images/, where the exporter publishes
+    # every image it downloads; do the same for the images saved with the page
+    os.makedirs(paths['images'], exist_ok=True)
+    # Only what the page links to is copied: the page's directory can hold anything, even
+    # the articles/ directory the copy is going into
+    for path in saved_page_resources(html_file):
+        relative_path = os.path.relpath(path, page_dir)
+        if not relative_path.startswith(os.pardir):
+            copied_path = os.path.join(paths['html_dir'], relative_path)
+            os.makedirs(os.path.dirname(copied_path), exist_ok=True)
+            shutil.copyfile(path, copied_path)
+            path = copied_path
+        filename = os.path.basename(path)
+        if any(ext in filename.lower() for ext in IMAGE_EXTENSIONS):
+            publish_file(path, os.path.join(paths['images'], filename))
+    return paths['html_file']
+
+def fetch_item(url, staging_dir, drivers, fetch_policy):
+    """Export stage for one URL; runs on a fetch thread"""
+    html_file, ready_timings = export_stage(url, staging_dir, drivers, fetch_policy)
+    return html_file, fetch_validators(url), ready_timings
+
+def run_batch(items, root=ARTICLES_DIR, fetch_workers=2, parse_workers=None,
+              fetch_policy=DEFAULT_FETCH_POLICY, force=False, cache=None):
+    """Convert every item and return one result dict per item"""
+    os.makedirs(root, exist_ok=True)
+    results = []
+    pending = []
+    seen_keys = set()
+    for item in items:
+        key = item_key(item)
+        result = {'item': item, 'key': key, 'status': None, 'error': None, 'seconds': None}
+        results.append(result)
+        if key in seen_keys:
+            result['status'] = 'duplicate'
+            continue
+        seen_keys.add(key)
+
+        # Whatever an interrupted run was in the middle of has to start over
+        discard_stale_staging_dirs(key, root)
+        if has_article(key, root) and not force:
+            result['status'] = 'skipped'
+            continue
+        if not is_url(item) and not os.path.isfile(item):
+            result['status'] = 'failed'
+            result['error'] = 'file not found'
+            continue
+        pending.append(result)
+
+    if not pending:
+        return results
+
+    # Fetching waits on the network and the browsers, so it gets a few threads and one browser
+    # each; parsing is CPU bound, so it gets a process per core
+    needs_browser = any(is_url(result['item']) for result in pending)
+    drivers = DriverPool(size=fetch_workers) if needs_browser else None
+    fetch_pool = ThreadPoolExecutor(max_workers=fetch_workers)
+    parse_pool = ProcessPoolExecutor(max_workers=parse_workers)
+    running = {}
+    try:
+        for result in pending:
+            result['started'] = time.perf_counter()
+            result['staging_dir'] = new_staging_dir(result['key'], root)
+            if is_url(result['item']):
+                future = fetch_pool.submit(fetch_item, result['item'], result['staging_dir'],
+                                           drivers, fetch_policy)
+                running[future] = ('fetch', result)
+            else:
+                try:
+                    html_file = copy_saved_page(result['item'], result['staging_dir'])
+                except OSError as e:
+                    finish_item(result, root, error=e)
+                    continue
+                future = parse_pool.submit(parse_stage, html_file, result['staging_dir'])
+                running[future] = ('parse', result)
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, result = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    finish_item(result, root, error=error)
+                elif stage == 'fetch':
+                    # Parse each page as soon as it is saved while the other fetches continue
+                    html_file, result['validators'], result['ready_timings'] = future.result()
+                    running[parse_pool.submit(parse_stage, html_file, result['staging_dir'])] = ('parse', result)
+                else:
+                    finish_item(result, root)
+                    if cache and is_url(result['item']):
+                        cache.record(result['item'], result['key'], result.get('validators'))
+                if result['status'] is not None:
+                    print_progress(results)
+    finally:
+        fetch_pool.shutdown(wait=True, cancel_futures=True)
+        parse_pool.shutdown(wait=True, cancel_futures=True)
+        if drivers:
+            drivers.close()
+        for result in pending:
+            if result['status'] is None:
+                discard_staging_dir(result['staging_dir'])
+
+    for result in pending:
+        for name in ('started', 'staging_dir', 'validators'):
+            result.pop(name, None)
+    return results
+
+def missing_figures(staging_dir):
+    """File names of the figures in a conversion that the reader's image URLs can't find"""
+    paths = article_paths(staging_dir)
+    with open(paths['content'], 'r', encoding='utf-8') as f:
+        visuals = json.load(f)['body']['visual_elements']
+    try:
+        # Figures a lazy conversion left to be downloaded on first view
+        with open(os.path.join(paths['html_dir'], 'image_sources.json'), 'r', encoding='utf-8') as f:
+            lazy = json.load(f)
+    except FileNotFoundError:
+        lazy = {}
+    missing = []
+    for visual in visuals:
+        if not visual or visual['type'] != 'figure' or not visual['image']['src']:
+            continue
+        filename = os.path.basename(visual['image']['src'])
+        if filename not in lazy and not os.path.isfile(os.path.join(paths['images'], filename)):
+            missing.append(filename)
+    return missing
+
+def finish_item(result, root, error=None):
+    if error is None:
+        result['missing_figures'] = missing_figures(result['staging_dir'])
+        if result['missing_figures']:
+            print(f"Figures of {result['item']} that won't load: {', '.join(result['missing_figures'])}")
+        if has_article(result['key'], root):
+            # --force: replace the stored copy
+            shutil.rmtree(os.path.join(root, result['key']), ignore_errors=True)
+        publish_article(result['staging_dir'], result['key'], root)
+        result['status'] = 'converted'
+    else:
+        discard_staging_dir(result['staging_dir'])
+        result['status'] = 'failed'
+        result['error'] = f"{type(error).__name__}: {error}"
+        print(f"Failed to convert {result['item']}: {result['error']}")
+    result['seconds'] = round(time.perf_counter() - result['started'], 2)
+
+def print_progress(results):
+    finished = sum(1 for result in results if result['status'] is not None)
+    print(f"[{finished}/{len(results)}]", flush=True)
+
+def summarize(results, elapsed):
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    converted = counts.get('converted', 0)
+    return {
+        'total': len(results),
+        'converted': converted,
+        'skipped': counts.get('skipped', 0),
+        'duplicate': counts.get('duplicate', 0),
+        'failed': counts.get('failed', 0),
+        'with_missing_figures': sum(1 for result in results if result.get('missing_figures')),
+        'elapsed_seconds': round(elapsed, 2),
+        'articles_per_minute': round(converted / elapsed * 60, 2) if elapsed else 0.0
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert a list of article URLs or saved pages into articles/')
+    parser.add_argument('list_file', help='file with one URL or saved HTML file per line')
+    parser.add_argument('--root', default=ARTICLES_DIR, help='where converted articles are stored')
+    parser.add_argument('--fetch-workers', type=int, default=int(os.environ.get('DRIVER_POOL_SIZE', 2)),
+                        help='pages fetched at once (one headless browser each)')
+    parser.add_argument('--parse-workers', type=int, default=None,
+                        help='parsing processes (default: one per core)')
+    parser.add_argument('--fetch-policy', choices=FETCH_POLICIES, default=DEFAULT_FETCH_POLICY)
+    parser.add_argument('--force', action='store_true', help='convert articles that are already stored again')
+    parser.add_argument('--report', default='batch_report.json', help='where to write the JSON report')
+    args = parser.parse_args()
+
+    # Uses the same limits as app.py, so the server sees the batch's conversions as cached
+    cache = ConversionCache(args.root,
+                            max_age=int(os.environ.get('CACHE_MAX_AGE', 30 * 24 * 3600)),
+                            max_bytes=int(os.environ.get('CACHE_MAX_BYTES', 2 * 1024 ** 3)),
+                            revalidate_after=int(os.environ.get('CACHE_REVALIDATE_AFTER', 24 * 3600)))
+    items = read_items(args.list_file)
+    start = time.perf_counter()
+    results = run_batch(items, args.root, args.fetch_workers, args.parse_workers,
+                        args.fetch_policy, args.force, cache=cache)
+    summary = summarize(results, time.perf_counter() - start)
+
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump({'summary': summary, 'articles': results}, f, indent=4)
+
+    print(f"Converted {summary['converted']}, skipped {summary['skipped']}, "
+          f"failed {summary['failed']} of {summary['total']} in {summary['elapsed_seconds']} s "
+          f"({summary['articles_per_minute']} articles/min)")
+    for result in results:
+        if result['status'] == 'failed':
+            print(f"  {result['item']}: {result['error']}")
+    print(f"Report written to {args.report}")
+    if summary['failed']:
+        sys.exit(1)
@@ -0,0 +1,297 @@
+import argparse
+import contextlib
+import html
+import importlib
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+from bs4 import BeautifulSoup
+
+from exportToHTML import rewrite_resource_urls
+from HTMLToJSON import html_to_json, parse_html, add_lxml_sourcelines, PARSER_BACKENDS
+from textProcessing import (clean_text, simple_sentence_tokenize, find_most_referenced_visual,
+                            tokenize_paragraph, most_referenced_visual)
+from searchIndex import build_search_index, SearchIndex, CorpusIndex, SEARCH_INDEX_FILE, search
+
+# Benchmarks for the conversion pipeline, run against a page saved by exportToHTML.py:
+#   python3 benchmarks.py rewrite webpage_files/index.html
+#   python3 benchmarks.py parsers webpage_files/index.html
+# Without a page, parsers runs on fixtures/acm_page/index.html, a small saved ACM page with some
+# malformed markup (stray and unclosed tags, an unquoted attribute, a bare &) and exits non-zero
+# when the backends disagree.
+#   python3 benchmarks.py text static/content.json
+#   python3 benchmarks.py search static/content.json --articles 50
+
+def best_time(function, repeat):
+    """Run function repeat times and return the fastest run in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_rewrite(html_file, repeat, copies):
+    """Compare one str.replace per resource with the single-pass rewrite_resource_urls"""
+    with open(html_file, 'r', encoding='utf-8') as f:
+        html_content = f.read() * copies
+
+    # Pretend every resource on the page was downloaded next to the page
+    written = {}
+    replacements = {}
+    for attr, resource_url in re.findall(r'(href|src)="([^"]*)"', html_content):
+        local_path = os.path.join('local', os.path.basename(resource_url) or 'index')
+        written[(attr, resource_url)] = local_path
+        replacements[(attr, html.unescape(resource_url))] = local_path
+
+    def replace_each():
+        # What save_webpage_to_html used to do
+        result = html_content
+        for (attr, resource_url), local_path in written.items():
+            result = result.replace(f'{attr}="{resource_url}"', f'{attr}="{local_path}"')
+        return result
+
+    def single_pass():
+        return rewrite_resource_urls(html_content, replacements)
+
+    if replace_each() != single_pass():
+        print("Warning: the two rewrites produced different pages")
+
+    old = best_time(replace_each, repeat)
+    new = best_time(single_pass, repeat)
+    print(f"{len(html_content) / 1e6:.1f} MB page, {len(replacements)} resources")
+    print(f"  str.replace per resource: {old * 1000:8.1f} ms")
+    print(f"  single pass:              {new * 1000:8.1f} ms  ({old / new:.1f}x faster)")
+
+# Generated table_/list_ ids are random, so number them in order of appearance before comparing
+GENERATED_ID_PATTERN = re.compile(r'\b(table|list)_[0-9a-f]{8}(?![0-9a-f])')
+
+def normalize_generated_ids(text):
+    seen = {}
+    return GENERATED_ID_PATTERN.sub(lambda m: seen.setdefault(m.group(0), f"{m.group(1)}_{len(seen)}"), text)
+
+PARSER_FIXTURE = 'fixtures/acm_page/index.html'
+
+# Tags whose sourcelines decide visual order and the figure a paragraph falls back to
+SOURCELINE_TAGS = ['section', 'div', 'p', 'li', 'figure', 'table']
+
+def check_sourcelines(html_file):
+    """Check that add_lxml_sourcelines gives tags the line numbers html.parser records"""
+    with open(html_file, 'r', encoding='utf-8') as f:
+        markup = f.read()
+    expected = [(tag.name, tag.sourceline) for tag in parse_html(markup, 'html.parser').find_all(SOURCELINE_TAGS)]
+    # Not through parse_html, which would quietly fall back to html.parser
+    soup = BeautifulSoup(markup, 'lxml')
+    if not add_lxml_sourcelines(soup, markup):
+        print("  lxml line numbers could not be matched to bs4's tags")
+        return False
+    actual = [(tag.name, tag.sourceline) for tag in soup.find_all(SOURCELINE_TAGS)]
+    if actual != expected:
+        print("  lxml sourcelines differ from html.parser's")
+        return False
+    print(f"  lxml sourcelines match html.parser's on {len(actual)} tags")
+    return True
+
+def bench_parsers(html_file, repeat):
+    """Time html_to_json on every installed parser backend and check their outputs match html.parser's"""
+    outputs = {}
+    for backend in PARSER_BACKENDS:
+        module = {'html.parser': 'html.parser', 'lxml': 'lxml', 'html5lib': 'html5lib'}[backend]
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            print(f"  {backend:12} not installed")
+            continue
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            def run():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    html_to_json(html_file, output_dir, parser=backend)
+            elapsed = best_time(run, repeat)
+
+            outputs[backend] = {}
+            for name in ['content', 'title', 'references']:
+                path = os.path.join(output_dir, f'{name}.json')
+                if os.path.exists(path):
+                    with open(path, 'r', encoding='utf-8') as f:
+                        outputs[backend][name] = normalize_generated_ids(f.read())
+        print(f"  {backend:12} {elapsed * 1000:8.1f} ms")
+
+    # Every backend has to produce exactly what the original html.parser setup did
+    mismatches = [(backend, name)
+                  for backend, files in outputs.items()
+                  for name in ['content', 'title', 'references']
+                  if files.get(name) != outputs['html.parser'].get(name)]
+    for backend, name in mismatches:
+        print(f"  {backend} produced a different {name}.json than html.parser")
+    if not mismatches:
+        print("  All backends produced identical content.json, title.json and references.json")
+    # Numbering tags in document order instead would keep the outputs above identical, so check the lines too
+    sourcelines_match = 'lxml' not in outputs or check_sourcelines(html_file)
+    return not mismatches and sourcelines_match
+
+def collect_paragraph_texts(content):
+    """Return every full_text in a content.json, which is what html_to_json tokenizes"""
+    texts = []
+    def walk(node):
+        if isinstance(node, dict):
+            if isinstance(node.get('full_text'), str):
+                texts.append(node['full_text'])
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+    walk(content)
+    return texts
+
+def inline_find_most_referenced_visual(text, visual_ids):
+    # What HTMLToJSON.py used to do: one re.finditer per kind of visual
+    figure_matches = list(re.finditer(r'Figure\s+(\d+)', text))
+    table_matches = list(re.finditer(r'Table\s+(\d+)', text))
+    first_figure = f"fig{figure_matches[0].group(1)}" if figure_matches else None
+    first_table = f"table{table_matches[0].group(1)}" if table_matches else None
+    figure_counts = {}
+    table_counts = {}
+    for match in figure_matches:
+        figure_counts[f"fig{match.group(1)}"] = figure_counts.get(f"fig{match.group(1)}", 0) + 1
+    for match in table_matches:
+        table_counts[f"table{match.group(1)}"] = table_counts.get(f"table{match.group(1)}", 0) + 1
+    figure_counts = {k: v for k, v in figure_counts.items() if k in visual_ids}
+    table_counts = {k: v for k, v in table_counts.items() if k in visual_ids}
+    all_refs = {**figure_counts, **table_counts}
+    if not all_refs:
+        return None
+    if first_figure and figure_counts.get(first_figure, 0) > 0:
+        return first_figure
+    if first_table and table_counts.get(first_table, 0) > 0:
+        return first_table
+    return max(all_refs.items(), key=lambda x: x[1])[0]
+
+def bench_text(content_file, repeat, copies):
+    """Compare inline regexes with textProcessing on every paragraph of a content.json"""
+    with open(content_file, 'r', encoding='utf-8') as f:
+        content = json.load(f)
+    texts = collect_paragraph_texts(content) * copies
+    visual_ids = {visual['id'] for visual in (content.get('body') or {}).get('visual_elements', []) if visual}
+
+    def inline():
+        results = []
+        for text in texts:
+            text = re.sub(r'\s+', ' ', text).strip()
+            sentences = [s.strip() for s in re.split(r'(?<=[.!?])\s+(?=[A-Z])', text) if s.strip()]
+            results.append((sentences, inline_find_most_referenced_visual(text, visual_ids)))
+        return results
+
+    def helpers():
+        results = []
+        for text in texts:
+            text = clean_text(text)
+            results.append((simple_sentence_tokenize(text), find_most_referenced_visual(text, visual_ids)))
+        return results
+
+    def tokenized():
+        results = []
+        for text in texts:
+            sentences, references = tokenize_paragraph(clean_text(text))
+            results.append((sentences, most_referenced_visual(references, visual_ids)))
+        return results
+
+    same = inline() == helpers() == tokenized()
+    old = best_time(inline, repeat)
+    compiled = best_time(helpers, repeat)
+    new = best_time(tokenized, repeat)
+    print(f"{len(texts)} paragraphs, {sum(map(len, texts)) / 1e6:.1f} MB of text")
+    print(f"  inline patterns:             {old * 1000:8.1f} ms")
+    print(f"  clean_text + helpers:        {compiled * 1000:8.1f} ms  ({old / compiled:.1f}x faster)")
+    print(f"  tokenize_paragraph:          {new * 1000:8.1f} ms  ({old / new:.1f}x faster)")
+    if not same:
+        print("  The tokenizers disagree on at least one paragraph")
+    return same
+
+def bench_search(content_file, repeat, articles, queries):
+    """Time building, loading and querying search indexes for a corpus of copies of one article"""
+    with open(content_file, 'r', encoding='utf-8') as f:
+        content = json.load(f)
+
+    start = time.perf_counter()
+    data = build_search_index(content)
+    built = time.perf_counter() - start
+    encoded = json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+    start = time.perf_counter()
+    indexes = [(str(i), SearchIndex(json.loads(encoded))) for i in range(articles)]
+    loaded = time.perf_counter() - start
+
+    print(f"{len(data['sentences'])} sentences, {len(data['postings'])} tokens, {len(encoded) / 1e3:.0f} KB index")
+    print(f"  build one index:             {built * 1000:8.1f} ms")
+    print(f"  load {articles} indexes:{' ' * (17 - len(str(articles)))}{loaded * 1000:8.1f} ms")
+    for query in queries:
+        for scope, searched in (('one article', indexes[:1]), (f'{articles} articles', indexes)):
+            elapsed = best_time(lambda: search(searched, query), repeat)
+            total, _ = search(searched, query)
+            print(f"  {query!r} over {scope}: {elapsed * 1000:.2f} ms, {total} hits")
+
+    # What /search queries: the same articles in one corpus index
+    with tempfile.TemporaryDirectory() as root:
+        for i in range(articles):
+            directory = os.path.join(root, f'{i:016x}')
+            os.makedirs(directory)
+            with open(os.path.join(directory, SEARCH_INDEX_FILE), 'w', encoding='utf-8') as f:
+                f.write(encoded)
+        corpus = CorpusIndex(root)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            corpus.sync()
+        synced = time.perf_counter() - start
+        print(f"  corpus index of {articles} articles:{' ' * (4 - len(str(articles)))}{synced * 1000:8.1f} ms")
+        for query in queries:
+            elapsed = best_time(lambda: corpus.search(query), repeat)
+            total, _ = corpus.search(query)
+            print(f"  {query!r} over the corpus index: {elapsed * 1000:.2f} ms, {total} hits")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark parts of the conversion pipeline')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    rewrite_parser = subparsers.add_parser('rewrite', help='resource URL rewriting in exportToHTML')
+    rewrite_parser.add_argument('html_file', nargs='?', default='webpage_files/index.html')
+    rewrite_parser.add_argument('--repeat', type=int, default=5)
+    rewrite_parser.add_argument('--copies', type=int, default=1,
+                                help='repeat the page this many times to simulate a larger one')
+
+    parsers_parser = subparsers.add_parser('parsers', help='html_to_json speed and output parity per parser backend')
+    parsers_parser.add_argument('html_file', nargs='?', default=PARSER_FIXTURE)
+    parsers_parser.add_argument('--repeat', type=int, default=3)
+
+    text_parser = subparsers.add_parser('text', help='sentence splitting and figure/table reference detection')
+    text_parser.add_argument('content_file', nargs='?', default='static/content.json')
+    text_parser.add_argument('--repeat', type=int, default=5)
+    text_parser.add_argument('--copies', type=int, default=1,
+                             help='repeat the paragraphs this many times to simulate a larger corpus')
+
+    search_parser = subparsers.add_parser('search', help='search index building and /search queries')
+    search_parser.add_argument('content_file', nargs='?', default='static/content.json')
+    search_parser.add_argument('--repeat', type=int, default=5)
+    search_parser.add_argument('--articles', type=int, default=50,
+                               help='search this many copies of the article to simulate a corpus')
+    search_parser.add_argument('--query', action='append', dest='queries',
+                               help='query to time (may be repeated)')
+
+    args = parser.parse_args()
+    if args.benchmark == 'rewrite':
+        bench_rewrite(args.html_file, args.repeat, args.copies)
+    elif args.benchmark == 'parsers':
+        if not bench_parsers(args.html_file, args.repeat):
+            sys.exit(1)
+    elif args.benchmark == 'text':
+        if not bench_text(args.content_file, args.repeat, args.copies):
+            sys.exit(1)
+    elif args.benchmark == 'search':
+        bench_search(args.content_file, args.repeat, args.articles,
+                     args.queries or ['evaluation', 'design feedback', '"heuristic evaluation"'])
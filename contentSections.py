@@ -0,0 +1,130 @@
+import json
+import os
+import re
+
+from precompressed import content_hash
+
+# outline.json is the reader's manifest: the abstract, every figure and table keyed by id, and the
+# list of sections with where each starts in the article's flattened paragraph order. The sections
+# themselves are in sections/section_<i>.json, already flattened the way the reader steps through
+# them, so the reader can fetch them one at a time and use them as they are. Section indices match
+# the reader's section_<i> keys.
+
+SECTIONS_DIR = 'sections'
+# 2: sentences carry their citations and figure mentions as link segments
+OUTLINE_VERSION = 2
+
+# Keys JavaScript orders numerically (ahead of all other keys) when iterating over an object
+ARRAY_INDEX_PATTERN = re.compile(r'^(0|[1-9][0-9]*)$')
+
+def section_filename(index):
+    return f'section_{index}.json'
+
+def majority_visual(sentences):
+    """The visual most of a paragraph's sentences point at, tie-broken like the reader's getMajorityVisual"""
+    counts = {}
+    for sentence in sentences or []:
+        if sentence['associated_visual']:
+            counts[sentence['associated_visual']] = counts.get(sentence['associated_visual'], 0) + 1
+
+    # Object.entries lists integer-like keys first, in numeric order, then the rest in insertion order;
+    # the first visual with the highest count wins
+    ordered = sorted((visual for visual in counts if ARRAY_INDEX_PATTERN.match(visual) and int(visual) < 2 ** 32 - 1),
+                     key=int)
+    ordered += [visual for visual in counts if visual not in ordered]
+    majority = None
+    max_count = 0
+    for visual in ordered:
+        if counts[visual] > max_count:
+            max_count = counts[visual]
+            majority = visual
+    return majority
+
+def flatten_paragraphs(container, extra=None):
+    paragraphs = [{**paragraph, **(extra or {}), 'lists': [], 'associated_visual': majority_visual(paragraph['sentences'])}
+                  for paragraph in container.get('paragraphs') or []]
+    # A container's lists are shown after its last paragraph
+    if container.get('lists') and paragraphs:
+        paragraphs[-1]['lists'] = container['lists']
+    return paragraphs
+
+def flatten_section(section):
+    """Turn one top-level section into the paragraph list the reader steps through (flattenSection in the reader)"""
+    paragraphs = flatten_paragraphs(section)
+
+    def walk(subsections, level):
+        for subsection in subsections:
+            paragraphs.append({'full_text': subsection['title'], 'isSubsectionTitle': True, 'level': level})
+            paragraphs.extend(flatten_paragraphs(subsection, {'subsectionLevel': level}))
+            walk(subsection.get('subsections') or [], level + 1)
+
+    walk(section.get('subsections') or [], 1)
+    return {'type': 'section', 'title': section['title'], 'paragraphs': paragraphs}
+
+def visual_entries(visual_elements):
+    """[id, data] pairs for the reader's visualElementsMap (processVisualElements in the reader)"""
+    entries = []
+    for element in visual_elements:
+        if not element:
+            continue
+        data = {
+            'type': element['type'],
+            'caption': element['caption'],
+            'path': (element.get('image') or {}).get('src') or '',
+            'variants': (element.get('image') or {}).get('variants') or []
+        }
+        if element['type'] == 'figure':
+            if 'alt' in element:
+                data['alt_text'] = element['alt']
+        elif element['type'] == 'table':
+            data['headers'] = element['headers']
+            data['rows'] = element['rows']
+        entries.append([element['id'], data])
+    return entries
+
+def write_section_files(content, output_dir):
+    """Write one file per top-level section plus outline.json; returns the paths written"""
+    sections_dir = os.path.join(output_dir, SECTIONS_DIR)
+    os.makedirs(sections_dir, exist_ok=True)
+    written = []
+    outline_sections = []
+    offset = 0
+    for index, section in enumerate(content['body']['sections']):
+        flattened = flatten_section(section)
+        data = json.dumps(flattened, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        path = os.path.join(sections_dir, section_filename(index))
+        with open(path, 'wb') as f:
+            f.write(data)
+        written.append(path)
+
+        outline_sections.append({
+            'key': f'section_{index}',
+            'id': section['id'],
+            'title': section['title'],
+            'offset': offset,
+            'paragraph_count': len(flattened['paragraphs']),
+            'subsections': [{'title': paragraph['full_text'], 'level': paragraph['level'], 'paragraph_index': i}
+                            for i, paragraph in enumerate(flattened['paragraphs'])
+                            if paragraph.get('isSubsectionTitle')],
+            # Lets the reader ask for a URL that can be cached for good
+            'version': content_hash(data)
+        })
+        offset += len(flattened['paragraphs'])
+
+    # A previous conversion into the same directory may have had more sections
+    for filename in os.listdir(sections_dir):
+        if filename.startswith('section_') and os.path.join(sections_dir, filename) not in written:
+            os.remove(os.path.join(sections_dir, filename))
+
+    outline = {
+        'version': OUTLINE_VERSION,
+        'abstract': content['abstract'],
+        'visuals': visual_entries(content['body']['visual_elements']),
+        'paragraph_count': offset,
+        'sections': outline_sections
+    }
+    path = os.path.join(output_dir, 'outline.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(outline, f, separators=(',', ':'), ensure_ascii=False)
+    written.append(path)
+    return written
@@ -0,0 +1,258 @@
+import json
+import os
+import shutil
+import threading
+import time
+
+import requests
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process lock on Windows; writes there still start from the file on disk
+    fcntl = None
+
+from articleStore import (ARTICLES_DIR, article_key, article_dir, article_paths,
+                          has_article, normalize_article_url)
+
+# Seconds between writes of cache hits' last_used times
+LAST_USED_FLUSH_INTERVAL = 60
+
+class ConversionCache:
+    """Maps article URLs and DOIs to stored conversions and decides when those are stale"""
+
+    def __init__(self, root=ARTICLES_DIR, max_age=30 * 24 * 3600, max_bytes=2 * 1024 ** 3,
+                 revalidate_after=24 * 3600):
+        self.root = root
+        self.max_age = max_age                    # seconds before a conversion is redone
+        self.max_bytes = max_bytes                # total size of all stored articles
+        self.revalidate_after = revalidate_after  # seconds before asking the source if it changed
+        self.index_file = os.path.join(root, 'cache_index.json')
+        self.lock = threading.Lock()
+        self.index = self._load()
+        self.touched = {}                         # key -> last_used not yet written out
+        self.revalidating = set()                 # URLs claimed by claim_revalidation
+        self.last_flush = time.time()
+
+    def _load(self):
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'aliases': {}, 'entries': {}}
+
+    def _write(self, index):
+        # Write to a temporary file first so a crash can't leave a truncated index
+        tmp_file = f"{self.index_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=4)
+        os.replace(tmp_file, self.index_file)
+
+    def _modify(self, change):
+        """Apply change() to the index as it is on disk and write it back; returns change()'s result
+
+        The server and batchConvert.py can share one index, so every write starts from the
+        file, under a lock on it, rather than from what this process loaded earlier.
+        Call with self.lock held.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with open(f"{self.index_file}.lock", 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.index = self._load()
+            for key, last_used in self.touched.items():
+                entry = self.index['entries'].get(key)
+                if entry:
+                    entry['last_used'] = max(entry['last_used'], last_used)
+            result = change()
+            self._write(self.index)
+        self.touched = {}
+        self.last_flush = time.time()
+        return result
+
+    def flush(self):
+        """Write the last_used times of recent hits to cache_index.json"""
+        with self.lock:
+            if self.touched:
+                self._modify(lambda: None)
+
+    def lookup(self, url, revalidate_stale=True):
+        """Return the key of a fresh stored conversion of url, or None if it has to be converted
+
+        With revalidate_stale=False a conversion due for revalidation is returned as it is,
+        for callers that revalidate it later (see claim_revalidation).
+        """
+        try:
+            return self._lookup(url, revalidate_stale)
+        finally:
+            if revalidate_stale:
+                # Whatever was claimed for url has been dealt with now
+                self.release_revalidation(url)
+
+    def _lookup(self, url, revalidate_stale):
+        identifier = normalize_article_url(url)
+        while True:
+            with self.lock:
+                key = self.index['aliases'].get(identifier, article_key(url))
+                entry = self.index['entries'].get(key)
+                if not entry or not has_article(key, self.root):
+                    return None
+
+                now = time.time()
+                if now - entry['stored_at'] > self.max_age:
+                    self._modify(lambda: self._evict(key))
+                    return None
+                if not revalidate_stale or now - entry['validated_at'] <= self.revalidate_after:
+                    # A hit only changes last_used, which eviction reads from memory, so it is
+                    # written out at most every LAST_USED_FLUSH_INTERVAL seconds
+                    entry['last_used'] = now
+                    self.touched[key] = now
+                    if now - self.last_flush > LAST_USED_FLUSH_INTERVAL:
+                        self._modify(lambda: None)
+                    return key
+                validators = dict(entry)
+
+            # Asking the source can take seconds, so don't hold up other lookups and records meanwhile
+            unchanged = revalidate(validators)
+
+            def apply():
+                current = self.index['entries'].get(key)
+                if not current or current['stored_at'] != validators['stored_at']:
+                    # Converted again or evicted while we were asking, so look again
+                    return False
+                if unchanged:
+                    current['validated_at'] = now
+                    current['last_used'] = now
+                else:
+                    self._evict(key)
+                return True
+
+            with self.lock:
+                applied = self._modify(apply)
+            if applied:
+                return key if unchanged else None
+
+    def claim_revalidation(self, url):
+        """True if url's stored conversion is due for revalidation and nobody has claimed it yet
+
+        The caller then has to revalidate it, by calling lookup(url), or give the claim back
+        with release_revalidation(url).
+        """
+        identifier = normalize_article_url(url)
+        with self.lock:
+            key = self.index['aliases'].get(identifier, article_key(url))
+            entry = self.index['entries'].get(key)
+            if (not entry or identifier in self.revalidating
+                    or time.time() - entry['validated_at'] <= self.revalidate_after):
+                return False
+            self.revalidating.add(identifier)
+            return True
+
+    def release_revalidation(self, url):
+        with self.lock:
+            self.revalidating.discard(normalize_article_url(url))
+
+    def record(self, url, key, validators=None):
+        """Remember a finished conversion of url under key"""
+        now = time.time()
+        entry = {
+            'url': url,
+            'doi': read_doi(key, self.root),
+            'stored_at': now,
+            'validated_at': now,
+            'last_used': now,
+            'etag': None,
+            'last_modified': None,
+            'size': directory_size(article_dir(key, self.root))
+        }
+        entry.update(validators or {})
+
+        def add():
+            self.index['entries'][key] = entry
+
+            # The submitted URL and the DOI from the front matter both lead here,
+            # so a doi.org link finds a conversion made from the publisher's URL
+            self.index['aliases'][normalize_article_url(url)] = key
+            if entry['doi']:
+                self.index['aliases'][normalize_article_url(entry['doi'])] = key
+
+            self._enforce_size_limit(keep=key)
+
+        with self.lock:
+            self._modify(add)
+
+    def _enforce_size_limit(self, keep=None):
+        # Drop the least recently used articles until everything fits, but never
+        # the one that was just converted
+        entries = self.index['entries']
+        total = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= entries[key]['size']
+            self._evict(key)
+
+    def _evict(self, key):
+        self.index['entries'].pop(key, None)
+        self.index['aliases'] = {k: v for k, v in self.index['aliases'].items() if v != key}
+        shutil.rmtree(article_dir(key, self.root), ignore_errors=True)
+        print(f"Evicted cached article {key}")
+
+def fetch_validators(url):
+    """Get the ETag/Last-Modified headers of url so the conversion can be revalidated later"""
+    try:
+        response = requests.head(url, allow_redirects=True, timeout=10)
+        return {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')
+        }
+    except requests.RequestException as e:
+        print(f"Failed to get validators for {url}: {e}")
+        return {}
+
+def revalidate(entry):
+    """Ask the source whether the article changed since it was converted"""
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    if not headers:
+        # Nothing to compare against, so rely on max_age alone
+        return True
+
+    try:
+        response = requests.head(entry['url'], headers=headers, allow_redirects=True, timeout=10)
+    except requests.RequestException as e:
+        # Keep serving the stored copy when the source can't be reached
+        print(f"Failed to revalidate {entry['url']}: {e}")
+        return True
+
+    if response.status_code == 304:
+        return True
+    if response.status_code == 200:
+        return (response.headers.get('ETag') == entry.get('etag')
+                and response.headers.get('Last-Modified') == entry.get('last_modified'))
+    return True
+
+def read_doi(key, root=ARTICLES_DIR):
+    """Read the DOI that extract_front_matter found for a stored article"""
+    try:
+        with open(article_paths(article_dir(key, root))['title'], 'r', encoding='utf-8') as f:
+            return json.load(f)['pubInfo']['DOI'] or None
+    except (FileNotFoundError, KeyError, TypeError, json.JSONDecodeError):
+        return None
+
+def directory_size(path):
+    # Images are hard-linked into images/, so count each file once
+    total = 0
+    seen = set()
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            stat = os.lstat(os.path.join(dirpath, filename))
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_size
+    return total
@@ -0,0 +1,154 @@
+import atexit
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.service import Service
+
+# Use system ChromeDriver directly; set CHROMEDRIVER_PATH to point somewhere else
+CHROMEDRIVER_PATH = os.environ.get(
+    'CHROMEDRIVER_PATH',
+    '/Users/thrisna/IdeaProjects/interactive_reading/interactive_reading_final/chromedriver')  #Linux/Mac
+# # or
+# CHROMEDRIVER_PATH = r'C:\path\to\your\chromedriver.exe'  # Windows
+
+def create_driver():
+    """Start a headless Chrome"""
+    chrome_options = webdriver.ChromeOptions()
+    chrome_options.add_argument('--headless')
+    service = Service(CHROMEDRIVER_PATH)
+    return webdriver.Chrome(service=service, options=chrome_options)
+
+def is_healthy(driver):
+    """Check that the browser behind driver still answers"""
+    try:
+        return driver.execute_script('return 1') == 1
+    except WebDriverException:
+        return False
+
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except WebDriverException:
+        pass
+
+class PoolClosedError(Exception):
+    """Raised when a browser is asked for after the pool was closed"""
+
+class DriverPool:
+    """Keeps headless browsers running between conversions and hands them out one page at a time"""
+
+    def __init__(self, size=2, max_pages=50, create=create_driver):
+        self.size = size            # most pages that may be open at once
+        self.max_pages = max_pages  # browsers are restarted after this many pages
+        self.create = create
+        self.idle = queue.LifoQueue()
+        self.pages_served = {}
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def warm(self, count=None):
+        """Start browsers ahead of time so the first conversions don't pay for startup"""
+        for _ in range(count or self.size):
+            if self.closed:
+                return
+            driver = self.create()
+            with self.lock:
+                self.pages_served[id(driver)] = 0
+            if self.closed:
+                # Closed while this one was starting
+                self._retire(driver)
+                return
+            self.idle.put(driver)
+
+    def checkout(self, timeout=None):
+        """Wait for a free page slot and return a healthy browser"""
+        if self.closed:
+            raise PoolClosedError("The browser pool is closed")
+        if not self.slots.acquire(timeout=timeout):
+            raise TimeoutError(f"No browser became free within {timeout} seconds")
+        try:
+            while True:
+                if self.closed:
+                    raise PoolClosedError("The browser pool was closed while waiting for a browser")
+                try:
+                    driver = self.idle.get_nowait()
+                except queue.Empty:
+                    driver = self.create()
+                    with self.lock:
+                        self.pages_served[id(driver)] = 0
+                    return driver
+
+                if is_healthy(driver):
+                    return driver
+                # Crashed or hung browser; replace it
+                self._retire(driver)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def checkin(self, driver, broken=False):
+        """Give a browser back after use, restarting it if it is broken or worn out"""
+        try:
+            with self.lock:
+                self.pages_served[id(driver)] = self.pages_served.get(id(driver), 0) + 1
+                worn_out = self.pages_served[id(driver)] >= self.max_pages
+
+            if broken or worn_out or self.closed:
+                self._retire(driver)
+                return
+
+            # Leave nothing from this article behind for the next one
+            try:
+                driver.delete_all_cookies()
+                driver.get('about:blank')
+            except WebDriverException:
+                self._retire(driver)
+                return
+            self.idle.put(driver)
+        finally:
+            self.slots.release()
+
+    @contextmanager
+    def driver(self, timeout=None):
+        """Borrow a browser for the duration of a with block"""
+        driver = self.checkout(timeout)
+        broken = False
+        try:
+            yield driver
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            self.checkin(driver, broken)
+
+    def _retire(self, driver):
+        with self.lock:
+            self.pages_served.pop(id(driver), None)
+        quit_driver(driver)
+
+    def close(self):
+        """Quit every idle browser; ones still checked out are quit when returned"""
+        self.closed = True
+        while True:
+            try:
+                self._retire(self.idle.get_nowait())
+            except queue.Empty:
+                break
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+def default_pool():
+    """Return the process-wide pool used when no pool is passed in"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = DriverPool(size=int(os.environ.get('DRIVER_POOL_SIZE', 2)),
+                                       max_pages=int(os.environ.get('DRIVER_MAX_PAGES', 50)))
+            atexit.register(_default_pool.close)
+        return _default_pool
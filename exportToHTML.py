@@ -1,166 +1,372 @@
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 import time
 import os
 import requests
 from urllib.parse import urljoin, urlparse
 import re
-from selenium.webdriver.chrome.service import Service
+import html
+import json
+import shutil
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from driverPool import default_pool
+from selenium.common.exceptions import WebDriverException
 
-def download_resource(url, save_dir):
+# JavaScript checks for when a rendered article is ready to be saved; each returns true once it holds
+READY_CHECKS = {
+    # The browser finished loading the document and its subresources
+    'dom': "return document.readyState === 'complete';",
+    # The ACM article body has been inserted
+    'body': "return document.querySelector('section.body') !== null;",
+    # MathJax (v2 or v3) has no typesetting left to do, or isn't on the page
+    'mathjax': '''
+        if (!window.MathJax) return true;
+        if (MathJax.Hub && MathJax.Hub.queue) {
+            return MathJax.Hub.queue.pending === 0 && !MathJax.Hub.queue.running;
+        }
+        if (MathJax.startup && MathJax.startup.promise) {
+            if (!window.__mathjaxReady) {
+                MathJax.startup.promise.then(() => { window.__mathjaxReady = true; });
+            }
+            return window.__mathjaxReady === true;
+        }
+        return true;
+    ''',
+}
+# 'network' waits until no new resources have been requested for NETWORK_IDLE_TIME seconds
+RESOURCE_COUNT_CHECK = "return performance.getEntriesByType('resource').length;"
+NETWORK_IDLE_TIME = 0.5
+
+DEFAULT_READY_CONDITIONS = os.environ.get('PAGE_READY_CONDITIONS', 'dom,body,mathjax').split(',')
+DEFAULT_READY_TIMEOUT = float(os.environ.get('PAGE_READY_TIMEOUT', 15))
+
+def wait_for_page_ready(driver, conditions=DEFAULT_READY_CONDITIONS, timeout=DEFAULT_READY_TIMEOUT,
+                        poll_interval=0.1):
+    """Wait until every readiness condition holds or timeout seconds pass, and report how long each took"""
+    start = time.monotonic()
+    pending = [condition.strip() for condition in conditions if condition.strip()]
+    unknown = [condition for condition in pending if condition != 'network' and condition not in READY_CHECKS]
+    if unknown:
+        raise ValueError(f"Unknown page readiness conditions: {', '.join(unknown)}")
+
+    timings = {}
+    resource_count = None
+    last_new_resource = start
+
+    while pending:
+        now = time.monotonic()
+        for condition in list(pending):
+            try:
+                if condition == 'network':
+                    count = driver.execute_script(RESOURCE_COUNT_CHECK)
+                    if count != resource_count:
+                        resource_count = count
+                        last_new_resource = now
+                    ready = now - last_new_resource >= NETWORK_IDLE_TIME
+                else:
+                    ready = bool(driver.execute_script(READY_CHECKS[condition]))
+            except WebDriverException:
+                # The page can be mid-navigation; try again on the next poll
+                ready = False
+
+            if ready:
+                timings[condition] = round(now - start, 3)
+                pending.remove(condition)
+
+        if not pending:
+            break
+        if now - start >= timeout:
+            # Save what has rendered so far rather than failing the conversion
+            print(f"Page not ready after {timeout}s, still waiting on: {', '.join(pending)}")
+            break
+        time.sleep(poll_interval)
+
+    timings['total'] = round(time.monotonic() - start, 3)
+    timings['timed_out'] = bool(pending)
+    print(f"Page ready wait took {timings['total']}s")
+    return timings
+
+# Resource download settings: total parallel downloads, parallel downloads per host,
+# seconds before giving up on a connection/read, and retries for failed requests
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', 16))
+DOWNLOAD_PER_HOST = int(os.environ.get('DOWNLOAD_PER_HOST', 6))
+DOWNLOAD_TIMEOUT = (5, 30)
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Downloaded files with these in their name are also published in the reader's images directory
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+
+def create_session(pool_size=DOWNLOAD_WORKERS, retries=DOWNLOAD_RETRIES):
+    """Create a keep-alive session that retries failed requests with exponential backoff"""
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5,
+                  status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+_session = None
+_session_lock = threading.Lock()
+
+def shared_session():
+    """Return the session all downloads in this process share, so connections get reused"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+def publish_file(source_path, published_path):
+    """Make source_path also appear at published_path without storing a second copy"""
+    if os.path.lexists(published_path):
+        os.remove(published_path)
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            # Create file path from URL
-            parsed = urlparse(url)
-            filename = os.path.basename(parsed.path)
-            local_path = os.path.join(save_dir, parsed.path.lstrip('/'))
-            
-            # Create directories if they don't exist
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            
-            # Save the file to original location
-            with open(local_path, 'wb') as f:
-                f.write(response.content)
-            
-            # If it's an image, also save to static/images
-            if any(ext in filename.lower() for ext in ['.jpg', '.jpeg', '.png', '.gif']):
-                static_images_dir = os.path.join('static', 'images')
-                static_path = os.path.join(static_images_dir, filename)
+        os.link(source_path, published_path)
+    except OSError:
+        try:
+            # Relative, so the link survives the article directory being moved
+            os.symlink(os.path.relpath(source_path, os.path.dirname(published_path)), published_path)
+        except OSError:
+            shutil.copyfile(source_path, published_path)
+
+def download_resource(url, save_dir, images_dir=os.path.join('static', 'images'), session=None):
+    try:
+        with (session or shared_session()).get(url, timeout=DOWNLOAD_TIMEOUT, stream=True) as response:
+            if response.status_code == 200:
+                # Create file path from URL
+                parsed = urlparse(url)
+                filename = os.path.basename(parsed.path)
+                local_path = os.path.join(save_dir, parsed.path.lstrip('/'))
+                
+                # Create directories if they don't exist
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
                 
-                # Copy to static/images directory
-                with open(static_path, 'wb') as f:
-                    f.write(response.content)
-            
-            return local_path
+                # Stream the file to its original location in chunks, so large figures
+                # never sit in memory whole and a failed download leaves no partial file
+                partial_path = f"{local_path}.{threading.get_ident()}.part"
+                with open(partial_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                os.replace(partial_path, local_path)
+                
+                # If it's an image, also publish it in the images directory the reader serves
+                if any(ext in filename.lower() for ext in IMAGE_EXTENSIONS):
+                    os.makedirs(images_dir, exist_ok=True)
+                    publish_file(local_path, os.path.join(images_dir, filename))
+                
+                return local_path
     except Exception as e:
         print(f"Failed to download {url}: {e}")
+        if 'partial_path' in locals() and os.path.exists(partial_path):
+            os.remove(partial_path)
     return None
 
-def save_webpage_to_html(url, output_dir):
+def fetch_lazy_image(filename, output_dir, images_dir):
+    """Download an image that a lazy conversion skipped; returns its path in images_dir or None"""
+    try:
+        with open(os.path.join(output_dir, 'image_sources.json'), 'r', encoding='utf-8') as f:
+            source_url = json.load(f).get(filename)
+    except FileNotFoundError:
+        return None
+    if not source_url or not download_resource(source_url, output_dir, images_dir):
+        return None
+    return os.path.join(images_dir, filename)
+
+def download_resources(urls, save_dir, images_dir=os.path.join('static', 'images'),
+                       workers=DOWNLOAD_WORKERS, per_host=DOWNLOAD_PER_HOST, session=None):
+    """Download urls in parallel and return a map of each url to its local path (None if it failed)"""
+    urls = list(dict.fromkeys(urls))  # each resource only once, in page order
+    if not urls:
+        return {}
+
+    # Limit how many requests go to any one host at the same time
+    host_slots = defaultdict(lambda: threading.Semaphore(per_host))
+    host_slots_lock = threading.Lock()
+
+    def fetch(resource_url):
+        with host_slots_lock:
+            slot = host_slots[urlparse(resource_url).netloc]
+        with slot:
+            return download_resource(resource_url, save_dir, images_dir, session)
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(urls))) as executor:
+        return dict(zip(urls, executor.map(fetch, urls)))
+
+# Which resources to save with a page:
+#   figures  - only images inside <figure> elements, the only resources the reader shows
+#   lazy     - nothing up front; figure images are fetched the first time the reader asks for them
+#   archival - every CSS, JS and image file, for a complete offline copy of the page
+FETCH_POLICIES = ('figures', 'lazy', 'archival')
+DEFAULT_FETCH_POLICY = os.environ.get('FETCH_POLICY', 'figures')
+
+# src attribute of every figure image, unescaped
+FIGURE_IMAGES_SCRIPT = "return Array.from(document.querySelectorAll('figure img[src]'), img => img.getAttribute('src'));"
+
+# src/href attributes as page_source writes them (always double-quoted, with & and " escaped
+# and, depending on the serializer, other characters such as non-breaking spaces too)
+RESOURCE_ATTR_PATTERN = re.compile(r'(href|src)="([^"]*)"')
+
+def rewrite_resource_urls(html_content, replacements):
+    """Point resource attributes at their local copies in a single pass over the page
+
+    replacements maps (attribute, unescaped value) to the new value, so a value matches however
+    the serializer escaped it.
+    """
+    if not replacements:
+        return html_content
+
+    def replace(match):
+        value = match.group(2)
+        if '&' in value:
+            value = html.unescape(value)
+        new_value = replacements.get((match.group(1), value))
+        return f'{match.group(1)}="{new_value}"' if new_value is not None else match.group(0)
+
+    return RESOURCE_ATTR_PATTERN.sub(replace, html_content)
+
+def resolve_resource_url(resource_url, page_url):
+    """Turn a src/href value from the page into an absolute URL"""
+    base_url = '/'.join(page_url.split('/')[:3])  # Get base URL (protocol + domain)
+    if resource_url.startswith('//'):
+        return 'https:' + resource_url
+    elif resource_url.startswith('/'):
+        return base_url + resource_url
+    elif not resource_url.startswith(('http://', 'https://')):
+        return urljoin(page_url, resource_url)
+    return resource_url
+
+def save_webpage_to_html(url, output_dir, images_dir=os.path.join('static', 'images'), pool=None,
+                         ready_conditions=DEFAULT_READY_CONDITIONS, ready_timeout=DEFAULT_READY_TIMEOUT,
+                         fetch_policy=DEFAULT_FETCH_POLICY):
+    if fetch_policy not in FETCH_POLICIES:
+        raise ValueError(f"Unknown fetch policy {fetch_policy!r}, expected one of {', '.join(FETCH_POLICIES)}")
+
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
     output_file = os.path.join(output_dir, 'index.html')
     
-    # Configure Chrome options
-    chrome_options = webdriver.ChromeOptions()
-    chrome_options.add_argument('--headless')
-    
-    # Use system ChromeDriver directly
-
-    service = Service('/Users/thrisna/IdeaProjects/interactive_reading/interactive_reading_final/chromedriver')  #Linux/Mac
-    # # or
-    # service = Service(r'C:\path\to\your\chromedriver.exe')  # Windows
-    
-    # Start WebDriver
-    driver = webdriver.Chrome(
-        service=service,
-        options=chrome_options
-    )
+    # Reuse an already-running headless Chrome instead of starting one per article
+    if pool is None:
+        pool = default_pool()
 
     # Delete existing JPG files before saving new ones
-    static_images_dir = os.path.join('static', 'images')
     #if directory exists, delete all jpg files in it
-    if os.path.exists(static_images_dir):
-        for file in os.listdir(static_images_dir):
+    if os.path.exists(images_dir):
+        for file in os.listdir(images_dir):
             if file.lower().endswith(('.jpg', '.jpeg')):
-                os.remove(os.path.join(static_images_dir, file))
+                os.remove(os.path.join(images_dir, file))
     
-    try:
+    with pool.driver() as driver:
         # Open the website
         driver.get(url)
         
-        # Wait for JavaScript to load
-        time.sleep(5)
+        # Wait for JavaScript to render the article instead of a fixed delay
+        ready_timings = wait_for_page_ready(driver, ready_conditions, ready_timeout)
         
         # Get the page source
         html_content = driver.page_source
+        figure_sources = driver.execute_script(FIGURE_IMAGES_SCRIPT) if fetch_policy != 'archival' else []
         
-        # Add error handler script to suppress error messages
-        error_handler = '''
-        <script>
-            // Override console.error
-            console.error = function() {};
-            
-            // Suppress all errors
-            window.addEventListener('error', function(e) {
-                e.stopPropagation();
-                e.stopImmediatePropagation();
-                e.preventDefault();
-                return true;
-            }, true);
-            
-            // Suppress unhandled rejections
-            window.addEventListener('unhandledrejection', function(e) {
-                e.stopPropagation();
-                e.stopImmediatePropagation();
-                e.preventDefault();
-                return true;
-            }, true);
-            
-            // MathJax specific error handling
-            window.MathJax = {
-                messageStyle: "none",
-                showMathMenu: false,
-                showMathMenuMSIE: false,
-                errorSettings: { 
-                    message: [""] 
-                },
-                extensions: ["tex2jax.js"],
-                jax: ["input/TeX", "output/HTML-CSS"],
-                tex2jax: {
-                    inlineMath: [["$","$"],["\\(","\\)"]],
-                    displayMath: [["$$","$$"],["\\[","\\]"]],
-                    processEscapes: true
-                },
-                "HTML-CSS": { 
-                    showMathMenu: false 
-                }
-            };
-            
-            // Hide Live Server error overlay
-            const style = document.createElement('style');
-            style.textContent = `
-                .error-message { display: none !important; }
-                #error-box { display: none !important; }
-                #error-overlay { display: none !important; }
-                .MathJax_Error { display: none !important; }
-            `;
-            document.head.appendChild(style);
-        </script>
-        '''
-        # Insert error handler after opening head tag
-        html_content = html_content.replace('<head>', '<head>' + error_handler)
+    # The browser is only needed for rendering, so it goes back to the pool
+    # before the resources are downloaded
+
+    # Add error handler script to suppress error messages
+    error_handler = '''
+    <script>
+        // Override console.error
+        console.error = function() {};
+        
+        // Suppress all errors
+        window.addEventListener('error', function(e) {
+            e.stopPropagation();
+            e.stopImmediatePropagation();
+            e.preventDefault();
+            return true;
+        }, true);
+        
+        // Suppress unhandled rejections
+        window.addEventListener('unhandledrejection', function(e) {
+            e.stopPropagation();
+            e.stopImmediatePropagation();
+            e.preventDefault();
+            return true;
+        }, true);
         
+        // MathJax specific error handling
+        window.MathJax = {
+            messageStyle: "none",
+            showMathMenu: false,
+            showMathMenuMSIE: false,
+            errorSettings: { 
+                message: [""] 
+            },
+            extensions: ["tex2jax.js"],
+            jax: ["input/TeX", "output/HTML-CSS"],
+            tex2jax: {
+                inlineMath: [["$","$"],["\\(","\\)"]],
+                displayMath: [["$$","$$"],["\\[","\\]"]],
+                processEscapes: true
+            },
+            "HTML-CSS": { 
+                showMathMenu: false 
+            }
+        };
+        
+        // Hide Live Server error overlay
+        const style = document.createElement('style');
+        style.textContent = `
+            .error-message { display: none !important; }
+            #error-box { display: none !important; }
+            #error-overlay { display: none !important; }
+            .MathJax_Error { display: none !important; }
+        `;
+        document.head.appendChild(style);
+    </script>
+    '''
+    # Insert error handler after opening head tag
+    html_content = html_content.replace('<head>', '<head>' + error_handler)
+    
+    # Work out the absolute URL of every resource worth saving
+    resources = []
+    if fetch_policy == 'archival':
         # Find all resources (CSS, JS, images)
         resource_urls = re.findall(r'(href|src)=["\']([^"\']+)["\']', html_content)
-        base_url = '/'.join(url.split('/')[:3])  # Get base URL (protocol + domain)
-        
-        # Download resources and update paths
         for attr, resource_url in resource_urls:
-            if resource_url.startswith('//'):
-                full_url = 'https:' + resource_url
-            elif resource_url.startswith('/'):
-                full_url = base_url + resource_url
-            elif not resource_url.startswith(('http://', 'https://')):
-                full_url = urljoin(url, resource_url)
-            else:
-                full_url = resource_url
-                
+            resource_url = html.unescape(resource_url)
+            full_url = resolve_resource_url(resource_url, url)
             if any(ext in full_url.lower() for ext in ['.css', '.js', '.jpg', '.png', '.gif']):
-                local_path = download_resource(full_url, output_dir)
-                if local_path:
-                    relative_path = os.path.relpath(local_path, output_dir)
-                    html_content = html_content.replace(f'{attr}="{resource_url}"', f'{attr}="{relative_path}"')
+                resources.append((attr, resource_url, full_url))
+    else:
+        for src in dict.fromkeys(figure_sources):
+            resources.append(('src', src, resolve_resource_url(src, url)))
+
+    if fetch_policy == 'lazy':
+        # Leave the page untouched and remember where each image lives, so the
+        # reader's first request for it can download it (see fetch_lazy_image)
+        image_sources = {os.path.basename(urlparse(full_url).path): full_url for _, _, full_url in resources}
+        with open(os.path.join(output_dir, 'image_sources.json'), 'w', encoding='utf-8') as f:
+            json.dump(image_sources, f, indent=4)
+        resources = []
+
+    # Download them all at once, then update paths
+    local_paths = download_resources([full_url for _, _, full_url in resources], output_dir, images_dir)
+    replacements = {}
+    for attr, resource_url, full_url in resources:
+        local_path = local_paths.get(full_url)
+        if local_path:
+            replacements[(attr, resource_url)] = os.path.relpath(local_path, output_dir)
+    html_content = rewrite_resource_urls(html_content, replacements)
+    
+    # Save the modified HTML
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(html_content)
         
-        # Save the modified HTML
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-            
-        print(f"Successfully saved webpage to {output_dir}")
-            
-    finally:
-        driver.quit()
+    print(f"Successfully saved webpage to {output_dir}")
+    return ready_timings
 
 if __name__ == "__main__":
     import sys
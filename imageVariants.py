@@ -0,0 +1,85 @@
+import os
+import sys
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Smaller WebP copies of each figure, made once at conversion time, so the reader can load a
+# thumbnail in the diagrams panel, a reading-width image next to the text and the full image only
+# in the popup. Needs Pillow (pip3 install Pillow); without it the reader keeps using the originals.
+
+VARIANTS_DIR = 'variants'
+# Tier name and the largest width it is resized to; None keeps the original size
+IMAGE_TIERS = [('thumb', 320), ('reading', 960), ('full', None)]
+WEBP_QUALITY = int(os.environ.get('WEBP_QUALITY', 80))
+
+def variant_filename(filename, tier):
+    return f"{os.path.splitext(filename)[0]}-{tier}.webp"
+
+def make_image_variants(images_dir, filename):
+    """Write the size tiers of images_dir/filename; returns [{tier, src, width, height}] or None"""
+    if Image is None:
+        return None
+    source_path = os.path.join(images_dir, filename)
+    variants_dir = os.path.join(images_dir, VARIANTS_DIR)
+    try:
+        with Image.open(source_path) as image:
+            image.load()
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+            os.makedirs(variants_dir, exist_ok=True)
+
+            variants = []
+            for tier, max_width in IMAGE_TIERS:
+                # Don't make copies bigger than the original, or two tiers of the same size
+                if max_width is not None and image.width <= max_width:
+                    continue
+                width = max_width or image.width
+                height = max(1, round(image.height * width / image.width))
+                variant_path = os.path.join(variants_dir, variant_filename(filename, tier))
+
+                # Made by an earlier conversion of the same image
+                if not (os.path.exists(variant_path)
+                        and os.path.getmtime(variant_path) >= os.path.getmtime(source_path)):
+                    resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+                    tmp_path = f"{variant_path}.{os.getpid()}.tmp"
+                    resized.save(tmp_path, 'WEBP', quality=WEBP_QUALITY, method=6)
+                    os.replace(tmp_path, variant_path)
+
+                variants.append({
+                    'tier': tier,
+                    'src': f"{VARIANTS_DIR}/{variant_filename(filename, tier)}",
+                    'width': width,
+                    'height': height
+                })
+            return variants
+    except (OSError, ValueError) as e:
+        print(f"Failed to make smaller copies of {source_path}: {e}")
+        return None
+
+def add_image_variants(visual, images_dir):
+    """Make the size tiers of a figure's image and record them in its visual_elements entry"""
+    if not visual or visual['type'] != 'figure' or not visual['image']['src']:
+        return
+    filename = os.path.basename(visual['image']['src'])
+    if not os.path.isfile(os.path.join(images_dir, filename)):
+        # Not downloaded (lazy fetch policy), so there is nothing to resize yet
+        return
+    variants = make_image_variants(images_dir, filename)
+    if variants:
+        visual['image']['variants'] = variants
+        visual['image']['srcset'] = srcset(variants)
+
+def srcset(variants):
+    return ', '.join(f"{variant['src']} {variant['width']}w" for variant in variants)
+
+if __name__ == "__main__":
+    # Make the tiers for images that are already saved, e.g. static/images
+    images_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join('static', 'images')
+    for filename in sorted(os.listdir(images_dir)):
+        if os.path.isfile(os.path.join(images_dir, filename)):
+            variants = make_image_variants(images_dir, filename)
+            if variants:
+                print(f"{filename}: {srcset(variants)}")
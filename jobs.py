@@ -0,0 +1,90 @@
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the pending queue is at its limit"""
+
+class JobQueue:
+    """Runs conversion jobs on a fixed number of worker threads and tracks their status"""
+
+    def __init__(self, run_job, workers=1, max_pending=20, max_finished=200):
+        # run_job(url, progress=callback) does the actual work and returns the result location
+        self.run_job = run_job
+        self.max_finished = max_finished
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+
+    def submit(self, url):
+        """Queue a conversion of url and return the new job's status"""
+        job = {
+            'id': uuid.uuid4().hex,
+            'url': url,
+            'status': 'queued',
+            'stage': 'queued',
+            'progress': 0.0,
+            'timings': {},
+            'result': None,
+            'error': None,
+            'created': time.time(),
+            'finished': None
+        }
+
+        with self.lock:
+            self.jobs[job['id']] = job
+        try:
+            self.pending.put_nowait(job['id'])
+        except queue.Full:
+            with self.lock:
+                del self.jobs[job['id']]
+            raise QueueFullError(f"{self.pending.maxsize} jobs are already waiting")
+
+        return dict(job)
+
+    def get(self, job_id):
+        """Return a copy of a job's status, or None if the id is unknown"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    def _prune(self):
+        # Forget the oldest finished jobs so the table doesn't grow forever
+        with self.lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job['finished']]
+            for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+                del self.jobs[job_id]
+
+    def _work(self):
+        while True:
+            job_id = self.pending.get()
+            url = self.get(job_id)['url']
+            self._update(job_id, status='running')
+
+            def progress(stage, fraction, timings=None):
+                fields = {'stage': stage, 'progress': round(fraction, 2)}
+                if timings is not None:
+                    # Copied so a later status read never sees the dict change under it
+                    fields['timings'] = dict(timings)
+                self._update(job_id, **fields)
+
+            try:
+                result = self.run_job(url, progress=progress)
+                self._update(job_id, status='done', stage='done', progress=1.0,
+                             result=result, finished=time.time())
+            except Exception as e:
+                print(f"Job {job_id} failed for {url}: {e}")
+                self._update(job_id, status='failed', error=str(e), finished=time.time())
+            finally:
+                self.pending.task_done()
+                self._prune()
@@ -0,0 +1,70 @@
+import os
+import time
+
+# Importing these here means selenium, requests and bs4 are loaded once per
+# server process instead of once per submitted URL
+from exportToHTML import save_webpage_to_html, DEFAULT_FETCH_POLICY
+from HTMLToJSON import html_to_json
+from articleStore import (ARTICLES_DIR, article_key, article_paths, has_article,
+                          new_staging_dir, publish_article, discard_staging_dir)
+from conversionCache import fetch_validators
+
+def export_stage(url, staging_dir, drivers=None, fetch_policy=DEFAULT_FETCH_POLICY):
+    """Render the page with selenium and save it with its resources; returns the saved HTML file
+    and how long each page readiness condition took"""
+    paths = article_paths(staging_dir)
+    ready_timings = save_webpage_to_html(url, paths['html_dir'], paths['images'], pool=drivers,
+                                         fetch_policy=fetch_policy)
+    return paths['html_file'], ready_timings
+
+def parse_stage(html_file, staging_dir):
+    """Turn a saved page into content/title/references JSON in staging_dir"""
+    # Only paths go in and out, so this can also run in a worker process
+    html_to_json(html_file, staging_dir)
+    return staging_dir
+
+def convert_article(url, progress=None, root=ARTICLES_DIR, cache=None, drivers=None,
+                    fetch_policy=DEFAULT_FETCH_POLICY):
+    """Save the webpage at url, convert it to the reader's JSON files and return its article key"""
+    # progress(stage, fraction, timings) lets a caller such as the job queue report status;
+    # timings holds the seconds each finished stage took
+    if progress is None:
+        progress = lambda stage, fraction, timings=None: None
+
+    # Repeat submissions of a stored article skip all the work
+    cached_key = cache.lookup(url) if cache else None
+    if cached_key:
+        progress('done', 1.0)
+        return cached_key
+
+    key = article_key(url)
+    if has_article(key, root):
+        # Stored before the cache knew about it (a stale copy would have been evicted)
+        if cache:
+            cache.record(url, key, fetch_validators(url))
+        progress('done', 1.0)
+        return key
+
+    # Convert into a private directory so concurrent jobs never share files
+    os.makedirs(root, exist_ok=True)
+    staging_dir = new_staging_dir(key, root)
+    timings = {}
+    try:
+        progress('exporting', 0.0, timings)
+        started = time.perf_counter()
+        html_file, timings['ready'] = export_stage(url, staging_dir, drivers, fetch_policy)
+        timings['export'] = round(time.perf_counter() - started, 3)
+
+        progress('parsing', 0.7, timings)
+        started = time.perf_counter()
+        parse_stage(html_file, staging_dir)
+        timings['parse'] = round(time.perf_counter() - started, 3)
+    except Exception:
+        discard_staging_dir(staging_dir)
+        raise
+
+    publish_article(staging_dir, key, root)
+    if cache:
+        cache.record(url, key, fetch_validators(url))
+    progress('done', 1.0, timings)
+    return key
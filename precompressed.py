@@ -0,0 +1,109 @@
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# The JSON files a conversion writes are compressed once, when they are written, instead of on
+# every request. Each file gets .gz (and .br when brotli is installed) siblings, and its content
+# hash is recorded in etags.json next to it so the server can answer If-None-Match and hand out
+# long-lived versioned URLs without reading the file.
+
+MANIFEST_FILE = 'etags.json'
+# Preferred first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+def write_file(path, data):
+    # Write next to the final file and rename, so a reader never sees half of it
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def compressed_variants(data):
+    """{Content-Encoding: compressed data} for every encoding available here"""
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return variants
+
+def write_precompressed(path):
+    """Write compressed siblings of path and record its ETag; returns the ETag"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    variants = compressed_variants(data)
+    write_file(f"{path}.gz", variants['gzip'])
+    if 'br' in variants:
+        write_file(f"{path}.br", variants['br'])
+    elif os.path.exists(f"{path}.br"):
+        # Left over from a run that had brotli; it would no longer match
+        os.remove(f"{path}.br")
+
+    directory, filename = os.path.split(path)
+    stat = os.stat(path)
+    manifest = read_manifest(directory)
+    manifest[filename] = {'etag': content_hash(data), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    write_file(os.path.join(directory, MANIFEST_FILE), json.dumps(manifest, indent=4).encode('utf-8'))
+    return manifest[filename]['etag']
+
+def recorded_etag(path, manifest=None):
+    """Return the ETag recorded for path, or None if the file changed since it was recorded"""
+    directory, filename = os.path.split(path)
+    entry = (manifest if manifest is not None else read_manifest(directory)).get(filename)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if not entry or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+        return None
+    return entry['etag']
+
+def choose_variant(path, accepted_encodings):
+    """Pick what to send for path: returns (file to send, Content-Encoding or None, ETag)"""
+    manifest = read_manifest(os.path.dirname(path))
+    etag = recorded_etag(path, manifest)
+    if etag is None:
+        # Copied (new mtime), edited, or written without write_precompressed; the siblings
+        # can only be trusted if the content still hashes to what was recorded
+        with open(path, 'rb') as f:
+            etag = content_hash(f.read())
+        entry = manifest.get(os.path.basename(path))
+        if not entry or entry['etag'] != etag:
+            return path, None, etag
+
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted_encodings and os.path.exists(path + suffix):
+            # Every representation needs its own strong ETag
+            return path + suffix, encoding, f"{etag}-{encoding}"
+    return path, None, etag
+
+def output_versions(directory, names):
+    """Content hashes of the named JSON files in directory, for building versioned URLs"""
+    manifest = read_manifest(directory)
+    versions = {}
+    for name in names:
+        etag = recorded_etag(os.path.join(directory, f'{name}.json'), manifest)
+        if etag:
+            versions[name] = etag
+    return versions
+
+if __name__ == "__main__":
+    # Precompress files written some other way, e.g. static/*.json
+    for path in sys.argv[1:]:
+        print(f"{path}: {write_precompressed(path)}")
@@ -0,0 +1,64 @@
+import os
+import threading
+from collections import OrderedDict
+
+class ResponseCache:
+    """Keeps response bodies built from files in memory until one of those files changes"""
+
+    def __init__(self, max_bytes=64 * 1024 ** 2):
+        self.max_bytes = max_bytes  # total size of cached bodies
+        self.entries = OrderedDict()  # key -> (signature, value, size), least recently used first
+        self.total = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, paths, build):
+        """Return the cached value for key, calling build() again if any of paths changed"""
+        signature = file_signature(paths)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] == signature:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Build outside the lock so a slow file doesn't hold up requests for other ones
+        value, size = build()
+        # Don't cache something that changed while it was being read
+        if file_signature(paths) != signature or size > self.max_bytes:
+            return value
+
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (signature, value, size)
+            self.total += size
+            while self.total > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+        return value
+
+    def invalidate(self, directory):
+        """Drop everything built from files in directory or below it, e.g. when the pipeline republishes it"""
+        directory = os.path.abspath(directory)
+        with self.lock:
+            # Section responses are keyed by articles/<key>/sections, so match subdirectories too
+            for key in [key for key in self.entries
+                        if key[0] == directory or key[0].startswith(directory + os.sep)]:
+                self._remove(key)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.total -= entry[2]
+
+def file_signature(paths):
+    # mtime, size and inode change whenever a file is rewritten or replaced by os.replace
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size, stat.st_ino))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
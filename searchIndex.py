@@ -0,0 +1,400 @@
+import heapq
+import json
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+from articleStore import stored_article_keys
+from contentSections import flatten_section
+from responseCache import file_signature
+
+# search_index.json is an inverted index over every sentence the reader shows (abstract, body
+# paragraphs, list items and captions), written next to content.json when an article is converted:
+#
+#   {"version": 1,
+#    "sentences": [{"id": "sec1_p2_s1", "text": "...", "context": "Introduction", "length": 14,
+#                   "location": {"state": "content", "section": 0, "paragraph": 3}}, ...],
+#    "postings": {"heuristic": [[<sentence number>, [<token positions>]], ...], ...}}
+#
+# "section" and "paragraph" are the reader's own coordinates (?state=content&section=&paragraph=).
+# Captions also have "visual", and only have section/paragraph when some paragraph shows the figure.
+
+SEARCH_INDEX_FILE = 'search_index.json'
+SEARCH_INDEX_VERSION = 1
+
+# Every stored article's index in one database, see CorpusIndex
+CORPUS_INDEX_FILE = 'search.sqlite3'
+CORPUS_INDEX_VERSION = 1
+CORPUS_SCHEMA = """
+CREATE TABLE articles (key TEXT PRIMARY KEY, signature TEXT, sentence_count INTEGER, total_length INTEGER);
+CREATE TABLE sentences (key TEXT, number INTEGER, data TEXT NOT NULL, PRIMARY KEY (key, number)) WITHOUT ROWID;
+CREATE TABLE postings (
+    token TEXT, key TEXT, number INTEGER, length INTEGER, frequency INTEGER,
+    positions TEXT NOT NULL,  -- space-separated
+    PRIMARY KEY (token, key, number)) WITHOUT ROWID;
+CREATE INDEX postings_by_article ON postings (key);
+"""
+
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+PHRASE_PATTERN = re.compile(r'"([^"]*)"')
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.casefold())
+
+def indexed_sentences(content):
+    """(sentence, location) for every sentence the reader shows, in reading order"""
+    if content.get('abstract'):
+        for sentence in content['abstract']['sentences']:
+            yield sentence, {'state': 'abstract'}
+
+    # Where each figure or table is first shown next to the text, for its caption's location
+    visual_locations = {}
+    for section_index, section in enumerate(content['body']['sections']):
+        for paragraph_index, paragraph in enumerate(flatten_section(section)['paragraphs']):
+            if paragraph.get('isSubsectionTitle'):
+                continue
+            location = {'state': 'content', 'section': section_index, 'paragraph': paragraph_index}
+            if paragraph['associated_visual']:
+                visual_locations.setdefault(paragraph['associated_visual'], location)
+            for sentence in paragraph['sentences']:
+                yield sentence, location
+            for list_data in paragraph['lists']:
+                for sentence in list_data.get('sentences') or []:
+                    yield sentence, location
+
+    for visual in content['body']['visual_elements']:
+        if not visual:
+            continue
+        location = {**visual_locations.get(visual['id'], {}), 'visual': visual['id']}
+        for sentence in visual['caption']['sentences']:
+            yield sentence, location
+
+def build_search_index(content):
+    sentences = []
+    postings = {}
+    for number, (sentence, location) in enumerate(indexed_sentences(content)):
+        tokens = tokenize(sentence['text'])
+        sentences.append({
+            'id': sentence['id'],
+            'text': sentence['text'],
+            'context': sentence['context'],
+            'length': len(tokens),
+            'location': location
+        })
+        positions = {}
+        for position, token in enumerate(tokens):
+            positions.setdefault(token, []).append(position)
+        for token, token_positions in positions.items():
+            postings.setdefault(token, []).append([number, token_positions])
+    return {'version': SEARCH_INDEX_VERSION, 'sentences': sentences, 'postings': postings}
+
+def write_search_index(content, output_dir):
+    """Write search_index.json for the content html_to_json produced; returns its path"""
+    path = os.path.join(output_dir, SEARCH_INDEX_FILE)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(build_search_index(content), f, separators=(',', ':'), ensure_ascii=False)
+    return path
+
+class SearchIndex:
+    """One article's search_index.json, loaded for querying"""
+
+    def __init__(self, data):
+        self.sentences = data['sentences']
+        # token -> {sentence number: positions}
+        self.postings = {token: dict(entries) for token, entries in data['postings'].items()}
+        self.total_length = sum(sentence['length'] for sentence in self.sentences)
+
+    def memory_size(self):
+        """Roughly how many bytes the loaded index takes, which is several times its file's size"""
+        # The containers and strings, leaving out ints, which are mostly small and shared
+        size = sys.getsizeof(self.sentences) + sys.getsizeof(self.postings)
+        for sentence in self.sentences:
+            size += sys.getsizeof(sentence) + sum(sys.getsizeof(value) for value in sentence.values())
+        for token, entries in self.postings.items():
+            size += sys.getsizeof(token) + sys.getsizeof(entries)
+            size += sum(sys.getsizeof(positions) for positions in entries.values())
+        return size
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != SEARCH_INDEX_VERSION:
+            raise ValueError(f"{path} is not search index version {SEARCH_INDEX_VERSION}")
+        return cls(data)
+
+    def phrase_matches(self, phrase):
+        return phrase_matches(self.postings, phrase)
+
+def phrase_matches(postings, phrase):
+    """Sentence numbers where the tokens of phrase appear one after another
+
+    postings maps each token to {sentence number: positions}, as in SearchIndex.postings.
+    """
+    lists = [postings.get(token) for token in phrase]
+    if not all(lists):
+        return set()
+    matches = set()
+    # Start from the rarest token's sentences
+    for number in min(lists, key=len):
+        if not all(number in token_postings for token_postings in lists):
+            continue
+        following = [set(token_postings[number]) for token_postings in lists[1:]]
+        if any(all(start + offset in positions for offset, positions in enumerate(following, 1))
+               for start in lists[0][number]):
+            matches.add(number)
+    return matches
+
+def parse_query(query):
+    """Split a query into its "quoted phrases" and all the tokens to rank by"""
+    phrases = [tokenize(phrase) for phrase in PHRASE_PATTERN.findall(query)]
+    phrases = [phrase for phrase in phrases if phrase]
+    terms = tokenize(PHRASE_PATTERN.sub(' ', query))
+    for phrase in phrases:
+        terms.extend(phrase)
+    return phrases, list(dict.fromkeys(terms))
+
+def search_hit(article, sentence, score):
+    return {
+        'article': article,
+        'id': sentence['id'],
+        'text': sentence['text'],
+        'context': sentence['context'],
+        'location': sentence['location'],
+        'score': round(score, 4)
+    }
+
+def search(indexes, query, limit=20):
+    """Rank the sentences of [(article, SearchIndex)] against query with BM25
+
+    Every quoted phrase has to appear in a hit; other words only add to its score.
+    Returns (total number of hits, the best limit hits).
+    """
+    phrases, terms = parse_query(query)
+    if not terms:
+        return 0, []
+
+    # Corpus-wide statistics, so scores from different articles can be compared
+    sentence_count = sum(len(index.sentences) for _, index in indexes)
+    average_length = sum(index.total_length for _, index in indexes) / max(sentence_count, 1)
+    idf = {}
+    for term in terms:
+        frequency = sum(len(index.postings.get(term, ())) for _, index in indexes)
+        idf[term] = math.log(1 + (sentence_count - frequency + 0.5) / (frequency + 0.5))
+
+    scored = []
+    for order, (article, index) in enumerate(indexes):
+        required = None
+        for phrase in phrases:
+            matches = index.phrase_matches(phrase)
+            required = matches if required is None else required & matches
+        if required is not None and not required:
+            continue
+
+        scores = {}
+        for term in terms:
+            for number, positions in index.postings.get(term, {}).items():
+                if required is not None and number not in required:
+                    continue
+                length = index.sentences[number]['length']
+                frequency = len(positions)
+                scores[number] = scores.get(number, 0) + idf[term] * frequency * (K1 + 1) / (
+                    frequency + K1 * (1 - B + B * length / average_length))
+        scored.extend((score, -order, -number, article, index) for number, score in scores.items())
+
+    # Ties go to the earlier article and sentence
+    best = heapq.nlargest(limit, scored, key=lambda hit: hit[:3])
+    hits = [search_hit(article, index.sentences[-negated_number], score)
+            for score, _, negated_number, article, index in best]
+    return len(scored), hits
+
+class CorpusIndex:
+    """The search indexes of every stored article in one SQLite file, next to the articles
+
+    A query reads only the postings of its own words, so it doesn't load every article's
+    search_index.json. Each article's rows are replaced when its search_index.json changes;
+    the file itself can always be deleted and is rebuilt from those on the next sync.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, CORPUS_INDEX_FILE)
+        self.lock = threading.Lock()  # one writer at a time
+        self.schema_lock = threading.Lock()
+        self.schema_checked = False
+
+    def connect(self):
+        os.makedirs(self.root, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        with self.schema_lock:
+            if not self.schema_checked:
+                if connection.execute('PRAGMA user_version').fetchone()[0] != CORPUS_INDEX_VERSION:
+                    # New file, or one written for another index format: start over
+                    for table in ('articles', 'sentences', 'postings'):
+                        connection.execute(f'DROP TABLE IF EXISTS {table}')
+                    connection.executescript(CORPUS_SCHEMA)
+                    connection.execute(f'PRAGMA user_version = {CORPUS_INDEX_VERSION}')
+                    connection.commit()
+                # Queries can go on while an article is being added
+                connection.execute('PRAGMA journal_mode = WAL')
+                self.schema_checked = True
+        return connection
+
+    def sync(self, keys=None):
+        """Bring the rows of the stored articles (or just keys) up to date with their search_index.json"""
+        with self.lock:
+            connection = self.connect()
+            try:
+                indexed = dict(connection.execute('SELECT key, signature FROM articles'))
+                stored = set(stored_article_keys(self.root))
+                checked = stored if keys is None else set(keys)
+                for key in sorted(checked & stored):
+                    directory = os.path.join(self.root, key)
+                    signature = json.dumps(file_signature([os.path.join(directory, SEARCH_INDEX_FILE)]))
+                    if indexed.get(key) != signature:
+                        self._add(connection, key, directory, signature)
+                # Evicted or removed since the last sync
+                for key in (checked & set(indexed)) - stored:
+                    with connection:
+                        self._remove(connection, key)
+            finally:
+                connection.close()
+
+    def add_article(self, directory):
+        """Index the article stored in directory, e.g. when publish_article puts it in place"""
+        key = os.path.basename(os.path.normpath(directory))
+        signature = json.dumps(file_signature([os.path.join(directory, SEARCH_INDEX_FILE)]))
+        with self.lock:
+            connection = self.connect()
+            try:
+                self._add(connection, key, directory, signature)
+            finally:
+                connection.close()
+
+    def _add(self, connection, key, directory, signature):
+        try:
+            index = SearchIndex.load(os.path.join(directory, SEARCH_INDEX_FILE))
+        except (FileNotFoundError, ValueError) as e:
+            # Converted before search indexes existed (or with another version of them)
+            print(f"Not searching {key}: {e}")
+            index = None
+
+        with connection:
+            self._remove(connection, key)
+            if index is None:
+                # Remember the signature anyway, so the next sync doesn't try again
+                connection.execute('INSERT INTO articles VALUES (?, ?, 0, 0)', (key, signature))
+                return
+            connection.execute('INSERT INTO articles VALUES (?, ?, ?, ?)',
+                               (key, signature, len(index.sentences), index.total_length))
+            connection.executemany('INSERT INTO sentences VALUES (?, ?, ?)', [
+                (key, number, json.dumps(sentence, separators=(',', ':'), ensure_ascii=False))
+                for number, sentence in enumerate(index.sentences)])
+            connection.executemany('INSERT INTO postings VALUES (?, ?, ?, ?, ?, ?)', [
+                (token, key, number, index.sentences[number]['length'], len(positions),
+                 ' '.join(map(str, positions)))
+                for token, entries in index.postings.items() for number, positions in entries.items()])
+
+    def _remove(self, connection, key):
+        for table in ('articles', 'sentences', 'postings'):
+            connection.execute(f'DELETE FROM {table} WHERE key = ?', (key,))
+
+    def search(self, query, limit=20, keys=None):
+        """Like search(), over every indexed article or only keys; hits name their article's key
+
+        SQLite adds up the BM25 scores, so only quoted phrases need postings read into Python.
+        """
+        phrases, terms = parse_query(query)
+        if not terms:
+            return 0, []
+
+        connection = self.connect()
+        try:
+            scope, parameters = '', []
+            if keys is not None:
+                scope = f" AND key IN ({', '.join('?' * len(keys))})"
+                parameters = list(keys)
+            sentence_count, total_length = connection.execute(
+                f'SELECT COALESCE(SUM(sentence_count), 0), COALESCE(SUM(total_length), 0) FROM articles WHERE 1{scope}',
+                parameters).fetchone()
+            average_length = total_length / max(sentence_count, 1)
+
+            term_list = ', '.join('?' * len(terms))
+            frequencies = dict(connection.execute(
+                f'SELECT token, COUNT(*) FROM postings WHERE token IN ({term_list}){scope} GROUP BY token',
+                terms + parameters))
+            weights = []
+            for term in terms:
+                frequency = frequencies.get(term, 0)
+                weights += [term, math.log(1 + (sentence_count - frequency + 0.5) / (frequency + 0.5))]
+
+            scores = f"""
+                WITH weights (token, idf) AS (VALUES {', '.join(['(?, ?)'] * len(terms))})
+                SELECT key, number, SUM(idf * frequency * {K1 + 1} / (frequency + {K1} * (1 - {B} + {B} * length / ?)))
+                    AS score
+                FROM postings JOIN weights USING (token)
+                WHERE 1{scope}
+                GROUP BY key, number"""
+            scores_parameters = weights + [average_length] + parameters
+
+            if phrases:
+                required = self._phrase_matches(connection, phrases, scope, parameters)
+                scored = [(score, key, number)
+                          for key, number, score in connection.execute(scores, scores_parameters)
+                          if (key, number) in required]
+                total = len(scored)
+                # Ties go to the earlier article and sentence
+                best = sorted(scored, key=lambda hit: (-hit[0], hit[1], hit[2]))[:limit]
+            else:
+                best = connection.execute(
+                    f'SELECT score, key, number, COUNT(*) OVER () FROM ({scores}) '
+                    'ORDER BY score DESC, key, number LIMIT ?', scores_parameters + [limit]).fetchall()
+                total = best[0][3] if best else connection.execute(
+                    f'SELECT COUNT(*) FROM ({scores})', scores_parameters).fetchone()[0]
+
+            hits = []
+            for score, key, number, *_ in best:
+                data, = connection.execute('SELECT data FROM sentences WHERE key = ? AND number = ?',
+                                           (key, number)).fetchone()
+                hits.append(search_hit(key, json.loads(data), score))
+        finally:
+            connection.close()
+        return total, hits
+
+    def _phrase_matches(self, connection, phrases, scope, parameters):
+        """(key, sentence number) of the sentences that contain every phrase"""
+        required = None
+        for phrase in phrases:
+            # token -> {(key, sentence number): positions}, for phrase_matches
+            postings = {}
+            for token in set(phrase):
+                postings[token] = {
+                    (key, number): [int(position) for position in positions.split()]
+                    for key, number, positions in connection.execute(
+                        f'SELECT key, number, positions FROM postings WHERE token = ?{scope}',
+                        [token] + parameters)}
+            matches = phrase_matches(postings, phrase)
+            required = matches if required is None else required & matches
+            if not required:
+                break
+        return required
+
+if __name__ == "__main__":
+    # Build the index for an existing content.json and try a query: searchIndex.py static/content.json "query"
+    content_file = sys.argv[1] if len(sys.argv) > 1 else 'static/content.json'
+    with open(content_file, 'r', encoding='utf-8') as f:
+        content = json.load(f)
+    path = write_search_index(content, os.path.dirname(content_file) or '.')
+    print(f"Wrote {path} ({os.path.getsize(path)} bytes)")
+    if len(sys.argv) > 2:
+        total, hits = search([(None, SearchIndex.load(path))], sys.argv[2])
+        print(f"{total} hits")
+        for hit in hits:
+            print(f"  {hit['score']:7.3f}  {hit['id']}: {hit['text']}")
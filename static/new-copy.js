@@ -13,6 +13,10 @@ let contentMap = new Map();
 //     }
 //     associated_visual: 
 // ]
+// one entry per top-level section, from outline.json (or built by breakUpContent):
+// {key, title, paragraph_count, subsections: [{title, level, paragraph_index}], version}
+let sectionOutline = [];
+const sectionRequests = new Map(); // section index -> Promise, so each section is fetched once
 let currentState = 'title'; // always preload with the first state to be title
 let currentSectionIndex = 0;
 let currentParagraphIndex = 0;
@@ -32,23 +36,105 @@ let citationsMap = new Map();
 // label: [1]
 // value: 1
 // citation: 
+// the same citations keyed by label without brackets ("1"), for links in content converted without reference ids
+let citationsByLabel = new Map();
+// outline.json version 2 and later: every sentence's citations and figure mentions are already
+// resolved into segments, so sentences without segments have none
+let contentPrelinked = false;
 let highlightsOn = false;
 let darkModeOn = false;
 
+// where this article's data and images are served from (set by the template)
+const articleBase = window.ARTICLE_KEY ? `/articles/${window.ARTICLE_KEY}` : null;
+
+// content hash of each data file (set by the template), so the browser can keep them cached
+const dataVersions = window.DATA_VERSIONS || {};
+
+function dataUrl(name) {
+    const url = articleBase ? `${articleBase}/${name}` : `/static/${name}.json`;
+    return dataVersions[name] ? `${url}?v=${dataVersions[name]}` : url;
+}
+
+function sectionUrl(index) {
+    const url = articleBase ? `${articleBase}/sections/${index}` : `/static/sections/section_${index}.json`;
+    const version = sectionOutline[index] && sectionOutline[index].version;
+    return version ? `${url}?v=${version}` : url;
+}
+
+function imageUrl(filename) {
+    return articleBase ? `${articleBase}/images/${filename}` : `/static/images/${filename}`;
+}
+
+// <img> attributes for a figure: lets the browser pick the smallest copy made by imageVariants.py
+// that fills `sizes`, or the original when the article has none
+function visualImageAttributes(visual, sizes) {
+    if (!visual.variants || visual.variants.length === 0) {
+        return `src="${imageUrl(visual.path.split('/').pop())}"`;
+    }
+    const srcset = visual.variants.map(variant => `${imageUrl(variant.src)} ${variant.width}w`).join(', ');
+    const largest = visual.variants[visual.variants.length - 1];
+    return `src="${imageUrl(largest.src)}" srcset="${srcset}" sizes="${sizes}"`;
+}
+
+// The whole article, for articles converted before outline.json existed
+function loadContent() {
+    return fetch(dataUrl('content')).then(response => response.json());
+}
+
+// outline.json has the abstract, the visuals and the list of sections; the sections themselves
+// are fetched as the reader gets to them, already flattened on the server (see contentSections.py).
+// Articles converted before it existed have no outline.
+function loadOutline() {
+    return fetch(dataUrl('outline')).then(response => response.ok ? response.json() : null);
+}
+
+function loadSection(index) {
+    if (!sectionRequests.has(index)) {
+        const request = fetch(sectionUrl(index))
+            .then(response => {
+                if (!response.ok) throw new Error(`Failed to load section ${index}: ${response.status}`);
+                return response.json();
+            })
+            .then(section => {
+                contentMap.set(`section_${index}`, section);
+            })
+            .catch(error => {
+                // Let the next attempt try again
+                sectionRequests.delete(index);
+                throw error;
+            });
+        sectionRequests.set(index, request);
+    }
+    return sectionRequests.get(index);
+}
+
+function prefetchSection(index) {
+    if (index >= 0 && index < sectionOutline.length && !contentMap.has(`section_${index}`)) {
+        loadSection(index).catch(error => console.error(error));
+    }
+}
+
 // kinda like my main
 document.addEventListener('DOMContentLoaded', function () {
     // Fetch all files concurrently
     Promise.all([
-        fetch('/static/content.json'),
-        fetch('/static/title.json'),
-        fetch('/static/references.json')
+        loadOutline(),
+        fetch(dataUrl('title')),
+        fetch(dataUrl('references'))
     ])
-        .then(([contentResponse, titleResponse, referencesResponse]) => 
-            Promise.all([contentResponse.json(), titleResponse.json(), referencesResponse.json()])
+        .then(([outline, titleResponse, referencesResponse]) => 
+            Promise.all([outline || loadContent(), titleResponse.json(), referencesResponse.json()])
         )
         .then(([contentData, titleData, referencesData]) => {
-            // Store content globally
-            content = contentData;
+            // Store content globally; with an outline it only has the abstract and the visuals
+            const outline = contentData.sections ? contentData : null;
+            if (outline) {
+                content = { abstract: outline.abstract };
+                sectionOutline = outline.sections;
+                contentPrelinked = outline.version >= 2;
+            } else {
+                content = contentData;
+            }
             
             // Process citations - might move this to another function later
             referencesData.forEach(citation => {
@@ -57,17 +143,24 @@ document.addEventListener('DOMContentLoaded', function () {
                     value: citation.value,
                     citation: citation.citation
                 });
+                // like the old lookup, the first citation with a label wins
+                const label = citation.label.replace(/[\[\]]/g, '');
+                if (!citationsByLabel.has(label)) {
+                    citationsByLabel.set(label, citationsMap.get(citation.id));
+                }
             });
             console.log('Processed', citationsMap.size, 'citations');
             
             // Process title data
             breakUpTitle(titleData);
 
-            // Process visual elements
-            visualElementsMap = processVisualElements(content);
+            // Process visual elements; the outline already has them in visualElementsMap's shape
+            visualElementsMap = outline ? new Map(outline.visuals) : processVisualElements(content);
             console.log('Visual elements:', visualElementsMap);
 
-            breakUpContent(content);
+            if (!outline) {
+                breakUpContent(content);
+            }
             createNavigationBar();
             createCitationsPanel();
             createDiagramsPanel();
@@ -126,6 +219,14 @@ function handleScroll(event) {
 }
 
 function navigateToState(state, sectionIndex = 0, paragraphIndex = 0) {
+    // Sections are fetched the first time they are shown
+    if (state === 'content' && !contentMap.has(`section_${sectionIndex}`) && sectionIndex < sectionOutline.length) {
+        loadSection(sectionIndex)
+            .then(() => navigateToState(state, sectionIndex, paragraphIndex))
+            .catch(error => console.error(error));
+        return;
+    }
+
     currentState = state;
     currentSectionIndex = sectionIndex;
     currentParagraphIndex = paragraphIndex;
@@ -218,67 +319,80 @@ function navigateToNextParagraph() {
     const section = contentMap.get(`section_${currentSectionIndex}`);
     if (!section) return;
 
-    currentParagraphIndex++;
+    // Fetch the next section while this one is being read
+    prefetchSection(currentSectionIndex + 1);
+
+    const [sectionIndex, paragraphIndex] = nextParagraphPosition(currentSectionIndex, currentParagraphIndex);
+    navigateToState('content', sectionIndex, paragraphIndex);
+}
+
+function navigateToPreviousParagraph() {
+    const section = contentMap.get(`section_${currentSectionIndex}`);
+    if (!section) return;
+
+    prefetchSection(currentSectionIndex - 1);
+
+    const position = previousParagraphPosition(currentSectionIndex, currentParagraphIndex);
+    if (!position) {
+        navigateToState('abstract');
+        return;
+    }
+    navigateToState('content', position[0], position[1]);
+}
+
+// [section index, paragraph index] the reader moves to from a paragraph when scrolling down
+function nextParagraphPosition(sectionIndex, paragraphIndex) {
+    const section = contentMap.get(`section_${sectionIndex}`);
+    paragraphIndex++;
     
     // Check if we've reached the end of the current section
-    if (currentParagraphIndex >= section.paragraphs.length) {
+    if (paragraphIndex >= section.paragraphs.length) {
         // Check if there's another section
-        const nextSection = contentMap.get(`section_${currentSectionIndex + 1}`);
-        if (nextSection) {
-            currentSectionIndex++;
-            currentParagraphIndex = 0;
+        if (sectionIndex + 1 < sectionOutline.length) {
+            sectionIndex++;
+            paragraphIndex = 0;
         } else {
             // If no next section, stay at the last paragraph of the current section
-            currentParagraphIndex = section.paragraphs.length - 1;
+            paragraphIndex = section.paragraphs.length - 1;
         }
     }
-    
-    navigateToState('content', currentSectionIndex, currentParagraphIndex);
+    return [sectionIndex, paragraphIndex];
 }
 
-function navigateToPreviousParagraph() {
-    const section = contentMap.get(`section_${currentSectionIndex}`);
-    if (!section) return;
+// ... and when scrolling up; null when that leaves the body for the abstract
+function previousParagraphPosition(sectionIndex, paragraphIndex) {
+    const section = contentMap.get(`section_${sectionIndex}`);
 
     // If we're at a content paragraph that follows a subsection title,
     // we need to go back two indices
-    if (currentParagraphIndex > 0) {
-        const currentParagraph = section.paragraphs[currentParagraphIndex];
-        const prevParagraph = section.paragraphs[currentParagraphIndex - 1];
+    if (paragraphIndex > 0) {
+        const currentParagraph = section.paragraphs[paragraphIndex];
+        const prevParagraph = section.paragraphs[paragraphIndex - 1];
         
         if (!currentParagraph.isSubsectionTitle && prevParagraph?.isSubsectionTitle) {
-            currentParagraphIndex -= 2;
+            paragraphIndex -= 2;
         } else {
-            currentParagraphIndex--;
+            paragraphIndex--;
         }
-    } else if (currentParagraphIndex <= 0) {
-        if (currentSectionIndex > 0) {
-            currentSectionIndex--;
-            const prevSection = contentMap.get(`section_${currentSectionIndex}`);
-            if (prevSection) {
-                currentParagraphIndex = prevSection.paragraphs.length - 1;
-            }
+    } else if (paragraphIndex <= 0) {
+        if (sectionIndex > 0) {
+            sectionIndex--;
+            paragraphIndex = sectionOutline[sectionIndex].paragraph_count - 1;
         } else {
-            navigateToState('abstract');
-            return;
+            return null;
         }
     }
 
     // Ensure we don't go below 0
-    if (currentParagraphIndex < 0) {
-        if (currentSectionIndex > 0) {
-            currentSectionIndex--;
-            const prevSection = contentMap.get(`section_${currentSectionIndex}`);
-            if (prevSection) {
-                currentParagraphIndex = prevSection.paragraphs.length - 1;
-            }
+    if (paragraphIndex < 0) {
+        if (sectionIndex > 0) {
+            sectionIndex--;
+            paragraphIndex = sectionOutline[sectionIndex].paragraph_count - 1;
         } else {
-            navigateToState('abstract');
-            return;
+            return null;
         }
     }
-    
-    navigateToState('content', currentSectionIndex, currentParagraphIndex);
+    return [sectionIndex, paragraphIndex];
 }
 
 // functions that actually render content to user
@@ -368,7 +482,11 @@ function renderParagraph(paragraph, textPanel, visualsPanel) {
             const visualDiv = document.createElement('div');
             visualDiv.classList.add('visual-element');
             visualDiv.id = 'visual-' + sentence.associated_visual;
-            visualDiv.innerHTML = `<img src="/static/images/${sentence.associated_visual}.jpg" alt="Visual for ${sentence.associated_visual}">`;
+            const visual = visualElementsMap.get(sentence.associated_visual);
+            const imageAttributes = visual && visual.type === 'figure'
+                ? visualImageAttributes(visual, '500px')
+                : `src="${imageUrl(sentence.associated_visual + '.jpg')}"`;
+            visualDiv.innerHTML = `<img ${imageAttributes} alt="Visual for ${sentence.associated_visual}">`;
             visualsPanel.appendChild(visualDiv);
         }
     });
@@ -411,11 +529,26 @@ function renderList(list, textPanel) {
     textPanel.appendChild(listElement);
 }
 
-function renderSection(sectionKey, paragraphIndex = 0) {
+// HTML for a sentence's link segments: plain strings, {cite: [{label, ref}]} and {figure, visual}
+function renderSegments(segments) {
+    return segments.map(segment => {
+        if (typeof segment === 'string') return segment;
+        if (segment.cite) {
+            const linkedCitations = segment.cite.map(({ label, ref }) =>
+                `<span class="citation-link" data-citation-num="${label}"${ref ? ` data-ref-id="${ref}"` : ''} style="cursor: pointer; color: #0066cc;">${label}</span>`
+            );
+            return '[' + linkedCitations.join(', ') + ']';
+        }
+        return `<span class="figure-link" data-figure-num="${segment.figure}"${segment.visual ? ` data-visual-id="${segment.visual}"` : ''} style="cursor: pointer; color: #0066cc;">Figure ${segment.figure}</span>`;
+    }).join('');
+}
+
+// Build the view of one paragraph of a section without touching the page, so it can be cached
+// and built ahead of time; renderSection puts it on the page
+function buildSectionView(sectionKey, paragraphIndex) {
     const section = contentMap.get(sectionKey);
-    if (!section) return;
+    if (!section) return null;
 
-    const contentSection = document.getElementById('content-section');
     const sectionDiv = document.createElement('div');
     sectionDiv.classList.add('section');
     sectionDiv.style.height = '100vh';
@@ -426,6 +559,9 @@ function renderSection(sectionKey, paragraphIndex = 0) {
     sectionDiv.style.top = '0';
     sectionDiv.style.left = '0';
     sectionDiv.style.width = '100%';
+    // skipsTitle: the paragraph is a subsection title, so the one after it is shown instead
+    // highlightsFound: what the lightbulb button shows, once there is a paragraph to show
+    const view = { element: sectionDiv, skipsTitle: false, highlightsFound: null };
     
     let currentParagraph = section.paragraphs[paragraphIndex];
     if (currentParagraph) {
@@ -446,8 +582,8 @@ function renderSection(sectionKey, paragraphIndex = 0) {
 
         // Only skip subsection titles if we're past the introduction
         if (paragraphIndex >= firstSubsectionIndex && currentParagraph.isSubsectionTitle) {
-            currentParagraphIndex++;
-            const nextParagraph = section.paragraphs[currentParagraphIndex];
+            view.skipsTitle = true;
+            const nextParagraph = section.paragraphs[paragraphIndex + 1];
             if (nextParagraph) {
                 currentParagraph = nextParagraph;
             }
@@ -503,6 +639,11 @@ function renderSection(sectionKey, paragraphIndex = 0) {
         let highlightsFound = false;
         
         let paragraphText = currentParagraph.full_text;
+        // Sentences with link segments are rendered from them, so the text needs no regex work
+        const sentences = currentParagraph.sentences || [];
+        const prelinked = sentences.length > 0 && (contentPrelinked || sentences.some(s => s.segments));
+        // highlight ids of the caption sentences each paragraph sentence matches
+        const sentenceHighlights = sentences.map(() => []);
         
         console.log('Highlights state:', {
             highlightsOn,
@@ -531,6 +672,10 @@ function renderSection(sectionKey, paragraphIndex = 0) {
                         if (similarity > similarityThreshold) {
                             highlightsFound = true;  // Set flag when highlights are found
                             const highlightId = `highlight-${pIndex}-${cIndex}`;
+                            if (prelinked) {
+                                sentenceHighlights[pIndex].push(highlightId);
+                                return;
+                            }
                             
                             // Add hoverable spans to paragraph
                             const escapedParagraphSentence = paragraphSentence.replace(/[.*+?^${}()|[\]\\]/g, '\\$&');
@@ -546,33 +691,31 @@ function renderSection(sectionKey, paragraphIndex = 0) {
             }
         }
 
-        // Update lightbulb button appearance based on highlights
-        const lightbulbBtn = document.getElementById('lightbulbBtn');
-        if (highlightsOn) {
-            if (highlightsFound) {
-                lightbulbBtn.style.backgroundColor = '#ffd700'; // Golden yellow when highlights found
-            } else {
-                lightbulbBtn.style.boxShadow = '0 0 10px rgba(255, 215, 0, 0.5)'; // Just the glow when no highlights found
-                lightbulbBtn.style.backgroundColor = 'white';
-            }
+        // The lightbulb button is updated when the view is shown
+        view.highlightsFound = highlightsFound;
+
+        if (prelinked) {
+            paragraphText = sentences.map((sentence, pIndex) => {
+                const sentenceText = sentence.segments ? renderSegments(sentence.segments) : sentence.text;
+                // the first match ends up outermost, as when the spans were added by replacing text
+                return sentenceHighlights[pIndex].reduceRight((inner, highlightId) =>
+                    `<span class="hoverable-text" data-highlight-id="${highlightId}" 
+                                style="cursor: pointer;">${inner}</span>`, sentenceText);
+            }).join(' ');
         } else {
-            // Reset to default when highlights are off
-            lightbulbBtn.style.backgroundColor = 'white';
-            lightbulbBtn.style.boxShadow = '0 2px 4px rgba(0,0,0,0.1)';
-        }
-
-        // Add citation and figure links (existing code)
-        paragraphText = paragraphText.replace(/\[([^\]]+)\]/g, (match, numbers) => {
-            const citations = numbers.split(',').map(num => num.trim());
-            const linkedCitations = citations.map(num => 
-                `<span class="citation-link" data-citation-num="${num}" style="cursor: pointer; color: #0066cc;">${num}</span>`
-            );
-            return '[' + linkedCitations.join(', ') + ']';
-        });
+            // Content converted before link segments existed
+            paragraphText = paragraphText.replace(/\[([^\]]+)\]/g, (match, numbers) => {
+                const citations = numbers.split(',').map(num => num.trim());
+                const linkedCitations = citations.map(num => 
+                    `<span class="citation-link" data-citation-num="${num}" style="cursor: pointer; color: #0066cc;">${num}</span>`
+                );
+                return '[' + linkedCitations.join(', ') + ']';
+            });
 
-        paragraphText = paragraphText.replace(/Figure (\d+)/g, (match, figureNum) => {
-            return `<span class="figure-link" data-figure-num="${figureNum}" style="cursor: pointer; color: #0066cc;">Figure ${figureNum}</span>`;
-        });
+            paragraphText = paragraphText.replace(/Figure (\d+)/g, (match, figureNum) => {
+                return `<span class="figure-link" data-figure-num="${figureNum}" style="cursor: pointer; color: #0066cc;">Figure ${figureNum}</span>`;
+            });
+        }
 
         contentHTML += `<p>${paragraphText}</p>`;
 
@@ -659,7 +802,6 @@ function renderSection(sectionKey, paragraphIndex = 0) {
         if (currentParagraph.associated_visual) {
             const visualData = visualElementsMap.get(currentParagraph.associated_visual);
             const visualCaption = visualData.caption.full_text;
-            const visualPath = visualData.path.split('/').pop();
             
             if (visualData) {
                 contentHTML += `
@@ -690,7 +832,7 @@ function renderSection(sectionKey, paragraphIndex = 0) {
                 
                 if (visualData.type === 'figure') {
                     contentHTML += `
-                        <img src="/static/images/${visualPath}" 
+                        <img ${visualImageAttributes(visualData, '500px')} 
                              style="width: 100%; height: auto; margin-bottom: 10px;">
                     `;
                 } else if (visualData.type === 'table') {
@@ -725,9 +867,8 @@ function renderSection(sectionKey, paragraphIndex = 0) {
 
         contentHTML += '</div>';
         sectionDiv.innerHTML = contentHTML;
-        contentSection.appendChild(sectionDiv);
 
-        // Get the newly created paragraph element after the content is added to DOM
+        // Get the newly created paragraph element
         const paragraphElement = sectionDiv.querySelector('.text-panel p');
         const visualPanel = sectionDiv.querySelector('.visual-panel');
 
@@ -766,7 +907,7 @@ function renderSection(sectionKey, paragraphIndex = 0) {
 
         // Add hover event listeners if highlights are on
         if (highlightsOn) {
-            const hoverableElements = document.querySelectorAll('.hoverable-text');
+            const hoverableElements = sectionDiv.querySelectorAll('.hoverable-text');
             hoverableElements.forEach(element => {
                 element.addEventListener('mouseenter', (e) => {
                     const highlightId = e.target.dataset.highlightId;
@@ -810,10 +951,7 @@ function renderSection(sectionKey, paragraphIndex = 0) {
     citationLinks.forEach(link => {
         link.addEventListener('click', (e) => {
             e.stopPropagation(); // Prevent event bubbling
-            const num = link.dataset.citationNum;
-            const citation = Array.from(citationsMap.values()).find(c => 
-                c.label.replace(/[\[\]]/g, '') === num
-            );
+            const citation = citationsMap.get(link.dataset.refId) || citationsByLabel.get(link.dataset.citationNum);
             if (citation) {
                 createCitationPopup(citation);
             }
@@ -839,8 +977,9 @@ function renderSection(sectionKey, paragraphIndex = 0) {
                 `f${figureNum}`
             ];
             
-            let visual = null;
-            for (const id of potentialIds) {
+            // Prelinked figure mentions carry the visual's id
+            let visual = visualElementsMap.get(link.dataset.visualId) || null;
+            for (const id of visual ? [] : potentialIds) {
                 if (visualElementsMap.has(id)) {
                     visual = visualElementsMap.get(id);
                     console.log('Found visual with ID:', id);
@@ -855,6 +994,98 @@ function renderSection(sectionKey, paragraphIndex = 0) {
             }
         });
     });
+
+    return view;
+}
+
+// Views built by buildSectionView, keyed by "<section key>:<paragraph index>", least recently used
+// first. They depend on the highlight and dark mode settings, so toggling either clears them.
+const renderCache = new Map();
+const RENDER_CACHE_SIZE = 16;
+// bumped on every render, so prerendering for a paragraph the reader has left stops
+let prerenderGeneration = 0;
+
+function getSectionView(sectionKey, paragraphIndex) {
+    const key = `${sectionKey}:${paragraphIndex}`;
+    let view = renderCache.get(key);
+    if (view) {
+        renderCache.delete(key);
+    } else {
+        view = buildSectionView(sectionKey, paragraphIndex);
+        if (!view) return null;
+    }
+    renderCache.set(key, view);
+    while (renderCache.size > RENDER_CACHE_SIZE) {
+        renderCache.delete(renderCache.keys().next().value);
+    }
+    return view;
+}
+
+function renderSection(sectionKey, paragraphIndex = 0) {
+    const cached = renderCache.has(`${sectionKey}:${paragraphIndex}`);
+    const view = getSectionView(sectionKey, paragraphIndex);
+    if (!view) return;
+
+    if (view.skipsTitle) {
+        currentParagraphIndex++;
+    }
+    if (view.highlightsFound !== null) {
+        updateLightbulb(view.highlightsFound);
+    }
+    if (cached) {
+        // It may have been taken off the page while a highlight was hovered
+        view.element.querySelectorAll('.hoverable-text').forEach(element => {
+            element.style.backgroundColor = 'transparent';
+        });
+    }
+    document.getElementById('content-section').appendChild(view.element);
+
+    prerenderAround(currentSectionIndex, currentParagraphIndex);
+}
+
+// Build the views for the paragraphs before and after this one while the browser is idle, so
+// scrolling to them only swaps the page's nodes
+function prerenderAround(sectionIndex, paragraphIndex) {
+    const generation = ++prerenderGeneration;
+    const positions = [
+        nextParagraphPosition(sectionIndex, paragraphIndex),
+        previousParagraphPosition(sectionIndex, paragraphIndex)
+    ];
+    const prerenderNext = () => {
+        if (generation !== prerenderGeneration || positions.length === 0) return;
+        const position = positions.shift();
+        // Positions in sections that haven't been fetched yet are built when they are shown
+        if (position && contentMap.has(`section_${position[0]}`) &&
+            !renderCache.has(`section_${position[0]}:${position[1]}`)) {
+            getSectionView(`section_${position[0]}`, position[1]);
+        }
+        whenIdle(prerenderNext);
+    };
+    whenIdle(prerenderNext);
+}
+
+function whenIdle(callback) {
+    if (window.requestIdleCallback) {
+        requestIdleCallback(callback, { timeout: 1000 });
+    } else {
+        setTimeout(callback, 50);
+    }
+}
+
+function updateLightbulb(highlightsFound) {
+    const lightbulbBtn = document.getElementById('lightbulbBtn');
+    if (highlightsOn) {
+        if (highlightsFound) {
+            lightbulbBtn.style.backgroundColor = '#ffd700'; // Golden yellow when highlights found
+        } else {
+            lightbulbBtn.style.boxShadow = '0 0 10px rgba(255, 215, 0, 0.5)'; // Just the glow when no highlights found
+            lightbulbBtn.style.backgroundColor = 'white';
+        }
+    } else {
+        // Reset to default when highlights are off
+        lightbulbBtn.style.backgroundColor = 'white';
+        lightbulbBtn.style.boxShadow = '0 2px 4px rgba(0,0,0,0.1)';
+    }
 }
 
 // methods that handle navigation bar and popups
@@ -1008,24 +1239,21 @@ function createNavigationBar() {
     }
 
     // Move all section buttons into the scroll container instead of directly in the panel
-    const sections = Array.from(contentMap.keys());
-    sections.forEach(sectionKey => {
-        const section = contentMap.get(sectionKey);
-        
+    sectionOutline.forEach((section, sectionIndex) => {
         const sectionButton = createStyledButton(section.title, 0, () => {
-            navigateToState('content', sectionKey.split('_')[1], 0);
+            navigateToState('content', sectionIndex, 0);
             sectionsPanel.style.left = '-240px';
             panelOpen = false;
         });
         scrollContainer.appendChild(sectionButton);
 
         const addedSubsections = new Set();
-        section.paragraphs.forEach((paragraph, index) => {
-            if (paragraph.isSubsectionTitle && !addedSubsections.has(paragraph.full_text)) {
-                addedSubsections.add(paragraph.full_text);
+        section.subsections.forEach(subsection => {
+            if (!addedSubsections.has(subsection.title)) {
+                addedSubsections.add(subsection.title);
                 
-                const subsectionButton = createStyledButton(paragraph.full_text, paragraph.level, () => {
-                    navigateToState('content', sectionKey.split('_')[1], index);
+                const subsectionButton = createStyledButton(subsection.title, subsection.level, () => {
+                    navigateToState('content', sectionIndex, subsection.paragraph_index);
                     sectionsPanel.style.left = '-240px';
                     panelOpen = false;
                 });
@@ -1042,7 +1270,7 @@ function createNavigationBar() {
     const buttons = [
         { 
             id: 'menuBtn', 
-            icon: '<img src="static/images/nav.png" width="20" height="20">',
+            icon: '<img src="/static/images/nav.png" width="20" height="20">',
             onClick: () => {
                 const isOpen = sectionsPanel.style.left === '60px';
                 sectionsPanel.style.left = isOpen ? '-240px' : '60px';
@@ -1052,7 +1280,7 @@ function createNavigationBar() {
         },
         { 
             id: 'referencesBtn', 
-            icon: '<img src="static/images/references.png" width="20" height="20">',
+            icon: '<img src="/static/images/references.png" width="20" height="20">',
             onClick: () => {
                 const citationsPanel = document.getElementById('citations-panel');
                 if (citationsPanel.style.left === '60px') {
@@ -1068,7 +1296,7 @@ function createNavigationBar() {
         },
         { 
             id: 'diagramsBtn', 
-            icon: '<img src="static/images/diagrams.png" width="20" height="20">',
+            icon: '<img src="/static/images/diagrams.png" width="20" height="20">',
             onClick: () => {
                 const diagramsPanel = document.getElementById('diagrams-panel');
                 if (diagramsPanelOpen) {
@@ -1136,7 +1364,7 @@ function createNavigationBar() {
     `;
 
     // Add lightbulb icon
-    lightbulbBtn.innerHTML = '<img src="static/images/lightbulb.png" width="20" height="20">';
+    lightbulbBtn.innerHTML = '<img src="/static/images/lightbulb.png" width="20" height="20">';
     
     lightbulbBtn.onmouseover = () => lightbulbBtn.style.backgroundColor = '#f0f0f0';
     lightbulbBtn.onmouseout = () => lightbulbBtn.style.backgroundColor = 'white';
@@ -1170,7 +1398,7 @@ function createNavigationBar() {
     `;
 
     // Add moon icon
-    darkModeBtn.innerHTML = '<img src="static/images/moon.png" width="20" height="20">';
+    darkModeBtn.innerHTML = '<img src="/static/images/moon.png" width="20" height="20">';
     
     darkModeBtn.onmouseover = () => darkModeBtn.style.backgroundColor = '#f0f0f0';
     darkModeBtn.onmouseout = () => darkModeBtn.style.backgroundColor = 'white';
@@ -1279,7 +1507,7 @@ function createDiagramsPanel() {
 
         if (visual.type === 'figure') {
             itemContainer.innerHTML = `
-                <img src="/static/images/${visual.path.split('/').pop()}" 
+                <img ${visualImageAttributes(visual, '320px')} 
                      style="width: 100%; height: auto; border-radius: 4px;">
                 <p style="margin-top: auto; font-weight: bold; text-align: center;">${title}</p>
             `;
@@ -1380,7 +1608,7 @@ function createVisualPopup(visual, id) {
 
     if (visual.type === 'figure') {
         content.innerHTML = `
-            <img src="/static/images/${visual.path.split('/').pop()}" 
+            <img ${visualImageAttributes(visual, '90vw')} 
                  style="max-width: 100%; max-height: 70vh; display: block; margin: 0 auto;">
             <p style="margin-top: 20px; padding: 0 40px;">${visual.caption.full_text}</p>
         `;
@@ -1668,100 +1896,116 @@ function breakUpTitle(titleData) {
     titleMap.set('referenceFormat', titleData.ACMReferenceFormat);
 }
 
-function breakUpContent(content) {
-    const body = content.body;
-    let sectionIndex = 0;
-    
-    function getMajorityVisual(sentences) {
-        if (!sentences || sentences.length === 0) return null;
-    
-        // Count occurrences of each associated_visual
-        const visualCounts = {};
-        sentences.forEach(sentence => {
-            if (sentence.associated_visual) {
-                visualCounts[sentence.associated_visual] = (visualCounts[sentence.associated_visual] || 0) + 1;
-            }
-        });
-    
-        // Find the most common associated_visual
-        let majorityVisual = null;
-        let maxCount = 0;
-        
-        Object.entries(visualCounts).forEach(([visual, count]) => {
-            if (count > maxCount) {
-                maxCount = count;
-                majorityVisual = visual;
-            }
-        });
+function getMajorityVisual(sentences) {
+    if (!sentences || sentences.length === 0) return null;
+
+    // Count occurrences of each associated_visual
+    const visualCounts = {};
+    sentences.forEach(sentence => {
+        if (sentence.associated_visual) {
+            visualCounts[sentence.associated_visual] = (visualCounts[sentence.associated_visual] || 0) + 1;
+        }
+    });
+
+    // Find the most common associated_visual
+    let majorityVisual = null;
+    let maxCount = 0;
     
-        return majorityVisual;
-    }
+    Object.entries(visualCounts).forEach(([visual, count]) => {
+        if (count > maxCount) {
+            maxCount = count;
+            majorityVisual = visual;
+        }
+    });
+
+    return majorityVisual;
+}
 
-    for (const section of body.sections) {
-        let allParagraphs = [];
+// Turn one top-level section into the flat paragraph list the reader steps through
+function flattenSection(section) {
+    let allParagraphs = [];
+    
+    // Add section's direct paragraphs first
+    if (section.paragraphs) {
+        const sectionParagraphs = section.paragraphs.map(p => ({
+            ...p,
+            lists: [],
+            associated_visual: getMajorityVisual(p.sentences)
+        }));
         
-        // Add section's direct paragraphs first
-        if (section.paragraphs) {
-            const sectionParagraphs = section.paragraphs.map(p => ({
-                ...p,
-                lists: [],
-                associated_visual: getMajorityVisual(p.sentences)
-            }));
-            
-            // If section has lists, attach them to the last paragraph
-            if (section.lists && section.lists.length > 0 && sectionParagraphs.length > 0) {
-                sectionParagraphs[sectionParagraphs.length - 1].lists = section.lists;
-            }
-            
-            allParagraphs = allParagraphs.concat(sectionParagraphs);
+        // If section has lists, attach them to the last paragraph
+        if (section.lists && section.lists.length > 0 && sectionParagraphs.length > 0) {
+            sectionParagraphs[sectionParagraphs.length - 1].lists = section.lists;
         }
         
-        // Then add subsection content
-        if (section.subsections && section.subsections.length > 0) {
-            function flattenSubsections(subsections, level = 1) {
-                subsections.forEach(subsection => {
-                    // Add subsection title
-                    allParagraphs.push({
-                        full_text: subsection.title,
-                        isSubsectionTitle: true,
-                        level: level
-                    });
+        allParagraphs = allParagraphs.concat(sectionParagraphs);
+    }
+    
+    // Then add subsection content
+    if (section.subsections && section.subsections.length > 0) {
+        function flattenSubsections(subsections, level = 1) {
+            subsections.forEach(subsection => {
+                // Add subsection title
+                allParagraphs.push({
+                    full_text: subsection.title,
+                    isSubsectionTitle: true,
+                    level: level
+                });
+                
+                // Add subsection's paragraphs with their associated lists and visuals
+                if (subsection.paragraphs) {
+                    let subsectionParagraphs = subsection.paragraphs.map(para => ({
+                        ...para,
+                        subsectionLevel: level,
+                        lists: [],
+                        associated_visual: getMajorityVisual(para.sentences)
+                    }));
                     
-                    // Add subsection's paragraphs with their associated lists and visuals
-                    if (subsection.paragraphs) {
-                        let subsectionParagraphs = subsection.paragraphs.map(para => ({
-                            ...para,
-                            subsectionLevel: level,
-                            lists: [],
-                            associated_visual: getMajorityVisual(para.sentences)
-                        }));
-                        
-                        // If the subsection has lists, attach them to the last paragraph
-                        if (subsection.lists && subsection.lists.length > 0 && subsectionParagraphs.length > 0) {
-                            subsectionParagraphs[subsectionParagraphs.length - 1].lists = subsection.lists;
-                        }
-                        
-                        allParagraphs = allParagraphs.concat(subsectionParagraphs);
+                    // If the subsection has lists, attach them to the last paragraph
+                    if (subsection.lists && subsection.lists.length > 0 && subsectionParagraphs.length > 0) {
+                        subsectionParagraphs[subsectionParagraphs.length - 1].lists = subsection.lists;
                     }
                     
-                    // Handle nested subsections
-                    if (subsection.subsections && subsection.subsections.length > 0) {
-                        flattenSubsections(subsection.subsections, level + 1);
-                    }
-                });
-            }
-            
-            flattenSubsections(section.subsections);
+                    allParagraphs = allParagraphs.concat(subsectionParagraphs);
+                }
+                
+                // Handle nested subsections
+                if (subsection.subsections && subsection.subsections.length > 0) {
+                    flattenSubsections(subsection.subsections, level + 1);
+                }
+            });
         }
+        
+        flattenSubsections(section.subsections);
+    }
+
+    return {
+        type: 'section',
+        title: section.title,
+        paragraphs: allParagraphs
+    };
+}
 
-        contentMap.set(`section_${sectionIndex}`, {
-            type: 'section',
+// Used when there is no outline.json: flatten every section up front and build the outline here
+function breakUpContent(content) {
+    sectionOutline = [];
+    content.body.sections.forEach((section, sectionIndex) => {
+        const flattened = flattenSection(section);
+        contentMap.set(`section_${sectionIndex}`, flattened);
+
+        const subsections = [];
+        flattened.paragraphs.forEach((paragraph, index) => {
+            if (paragraph.isSubsectionTitle) {
+                subsections.push({ title: paragraph.full_text, level: paragraph.level, paragraph_index: index });
+            }
+        });
+        sectionOutline.push({
+            key: `section_${sectionIndex}`,
             title: section.title,
-            paragraphs: allParagraphs
+            paragraph_count: flattened.paragraphs.length,
+            subsections: subsections
         });
-        
-        sectionIndex++;
-    }
+    });
 }
 
 function processVisualElements(content) {
@@ -1774,6 +2018,7 @@ function processVisualElements(content) {
                 type: element.type,
                 caption: element.caption,
                 path: element.image?.src || "",
+                variants: element.image?.variants || [],
             };
             
             if (element.type === 'figure') {
@@ -1826,22 +2071,11 @@ function toggleHighlights() {
         }
     }
 
-    // Update lightbulb button appearance
-    const lightbulbBtn = document.getElementById('lightbulbBtn');
-    if (highlightsOn) {
-        if (highlightsFound) {
-            lightbulbBtn.style.backgroundColor = '#ffd700'; // Golden yellow when highlights found
-        } else {
-            lightbulbBtn.style.boxShadow = '0 0 10px rgba(255, 215, 0, 0.5)'; // Just the glow when no highlights found
-            lightbulbBtn.style.backgroundColor = 'white';
-        }
-    } else {
-        // Reset to default when highlights are off
-        lightbulbBtn.style.backgroundColor = 'white';
-        lightbulbBtn.style.boxShadow = '0 2px 4px rgba(0,0,0,0.1)';
-    }
+    updateLightbulb(highlightsFound);
 
-    // Force re-render of current section to apply/remove highlights
+    // Force re-render of current section to apply/remove highlights; views built with the old
+    // setting can't be reused
+    renderCache.clear();
     navigateToState(currentState, currentSectionIndex, currentParagraphIndex);
 }
 
@@ -1852,10 +2086,7 @@ function attachEventListeners(element) {
     citationLinks.forEach(link => {
         link.addEventListener('click', (e) => {
             e.stopPropagation();
-            const num = link.dataset.citationNum;
-            const citation = Array.from(citationsMap.values()).find(c => 
-                c.label.replace(/[\[\]]/g, '') === num
-            );
+            const citation = citationsMap.get(link.dataset.refId) || citationsByLabel.get(link.dataset.citationNum);
             if (citation) {
                 createCitationPopup(citation);
             }
@@ -1876,8 +2107,9 @@ function attachEventListeners(element) {
                 `f${figureNum}`
             ];
             
-            let visual = null;
-            for (const id of potentialIds) {
+            // Prelinked figure mentions carry the visual's id
+            let visual = visualElementsMap.get(link.dataset.visualId) || null;
+            for (const id of visual ? [] : potentialIds) {
                 if (visualElementsMap.has(id)) {
                     visual = visualElementsMap.get(id);
                     break;
@@ -1936,6 +2168,8 @@ function calculateCosineSimilarity(str1, str2) {
 // Add dark mode toggle function
 function toggleDarkMode() {
     darkModeOn = !darkModeOn;
+    // Views built for the other mode have the wrong button colors
+    renderCache.clear();
     const isDarkMode = document.body.classList.toggle('dark-mode');
     
     if (darkModeOn) {